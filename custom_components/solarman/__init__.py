@@ -1,29 +1,94 @@
 """The SolarMAN logger integration."""
 from __future__ import annotations
-from asyncio.streams import StreamReader, StreamWriter
 
 import logging
+from datetime import timedelta
+
+import voluptuous as vol
 
 from homeassistant.config_entries import ConfigType, ConfigEntry
 from homeassistant.core import HomeAssistant
 from homeassistant.const import CONF_HOST, CONF_PORT, CONF_DEVICE_ID
+from homeassistant.helpers.event import async_track_time_interval
+from homeassistant.util.network import is_ip_address
 
-from .const import DOMAIN
+from .const import (
+    DOMAIN,
+    CONF_DISCOVERY_INTERVAL,
+    CONF_MAX_CONCURRENCY,
+    DATA_FLEET,
+    DEFAULT_DISCOVERY_INTERVAL,
+    DEFAULT_MAX_CONCURRENCY,
+    DISCOVERY_TIMEOUT,
+)
+from .discovery import async_discover
+from .fleet import FleetPoller
+from .services import async_setup_services
+from .storage import async_remove_storage
 
 _LOGGER = logging.getLogger(__name__)
 
 PLATFORMS: list[str] = ["sensor"]
 
 
-# async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
-#     """Set up the SolarMAN logger component."""
-#     hass.data.setdefault(DOMAIN, {})
-#     return True
+CONFIG_SCHEMA = vol.Schema(
+    {
+        vol.Optional(DOMAIN): vol.Schema(
+            {
+                vol.Optional(CONF_MAX_CONCURRENCY, default=DEFAULT_MAX_CONCURRENCY): vol.All(int, vol.Range(min=1)),
+                vol.Optional(CONF_DISCOVERY_INTERVAL, default=DEFAULT_DISCOVERY_INTERVAL): vol.All(int, vol.Range(min=0)),
+            }
+        )
+    },
+    extra=vol.ALLOW_EXTRA,
+)
+
+
+async def async_setup(hass: HomeAssistant, config: ConfigType) -> bool:
+    """Set up the SolarMAN logger component."""
+    conf = config.get(DOMAIN, {})
+    hass.data.setdefault(DOMAIN, {})[DATA_FLEET] = FleetPoller(
+        hass, max_concurrency=conf.get(CONF_MAX_CONCURRENCY, DEFAULT_MAX_CONCURRENCY)
+    )
+
+    discovery_interval = conf.get(CONF_DISCOVERY_INTERVAL, DEFAULT_DISCOVERY_INTERVAL)
+    if discovery_interval:
+        async def _async_rescan(_now) -> None:
+            await async_update_logger_hosts(hass)
+
+        async_track_time_interval(hass, _async_rescan, timedelta(minutes=discovery_interval))
+
+    async_setup_services(hass)
+    return True
+
+
+async def async_update_logger_hosts(hass: HomeAssistant) -> None:
+    """Rescan the network and follow loggers that were given a new address
+
+    Only entries configured with an IP address are updated; a hostname is
+    left for DNS to follow. Updating the options reconnects the logger
+    through update_listener.
+    """
+    entries = hass.config_entries.async_entries(DOMAIN)
+    if not entries:
+        return
+    try:
+        found = await async_discover(DISCOVERY_TIMEOUT)
+    except OSError as err:
+        _LOGGER.debug('__init__.py:async_update_logger_hosts: discovery failed: %s', err)
+        return
+    for entry in entries:
+        host = entry.options.get(CONF_HOST)
+        logger = found.get(entry.options.get(CONF_DEVICE_ID))
+        if logger is None or logger.ip == host or not is_ip_address(host):
+            continue
+        _LOGGER.info('Data logger %s moved from %s to %s', logger.serial, host, logger.ip)
+        hass.config_entries.async_update_entry(entry, options={**entry.options, CONF_HOST: logger.ip})
 
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up SolarMAN logger from a config entry."""
-    _LOGGER.debug(f'__init__.py:async_setup_entry({entry.as_dict()})')
+    _LOGGER.debug('__init__.py:async_setup_entry(%s)', entry.entry_id)
     hass.config_entries.async_setup_platforms(entry, PLATFORMS)
     entry.async_on_unload(entry.add_update_listener(update_listener))
     return True
@@ -31,17 +96,32 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
 
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
-    _LOGGER.debug(f'__init__.py:async_unload_entry({entry.as_dict()})')
+    _LOGGER.debug('__init__.py:async_unload_entry(%s)', entry.entry_id)
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
-        hass.data[DOMAIN][entry.entry_id].sock.close()
-        hass.data[DOMAIN].pop(entry.entry_id)
+        # Missing if the platform failed to set up, e.g. its first refresh
+        # failed; it has then already unregistered and closed the inverter
+        inverter = hass.data[DOMAIN].pop(entry.entry_id, None)
+        if inverter is not None:
+            hass.data[DOMAIN][DATA_FLEET].unregister(entry.entry_id)
+            await inverter.async_close()
     return unload_ok
 
 
+async def async_remove_entry(hass: HomeAssistant, entry: ConfigEntry) -> None:
+    """Remove the saved state of a deleted logger."""
+    _LOGGER.debug('__init__.py:async_remove_entry(%s)', entry.entry_id)
+    await async_remove_storage(hass, entry.entry_id)
+
+
 async def update_listener(hass: HomeAssistant, entry: ConfigEntry) -> None:
     """Handle options update."""
-    _LOGGER.debug(f'__init__.py:update_listener({entry.as_dict()})')
-    hass.data[DOMAIN][entry.entry_id].config(entry)
+    _LOGGER.debug('__init__.py:update_listener(%s): %s', entry.entry_id, entry.options)
     entry.title = entry.options[CONF_HOST]
+    inverter = hass.data[DOMAIN].get(entry.entry_id)
+    if inverter is None:
+        # Not set up yet, e.g. still retrying on the old address
+        await hass.config_entries.async_reload(entry.entry_id)
+        return
+    inverter.config(entry)
 
@@ -0,0 +1,429 @@
+""" Benchmarks for the hot paths of the integration.
+
+Run from this directory, e.g. `python benchmark.py fanout`. Only modules that
+do not depend on Home Assistant are exercised, so no HA install is needed.
+The e2e benchmark polls loggers simulated by simulator.py.
+"""
+import asyncio
+import collections
+import statistics
+import sys
+import threading
+import time
+import timeit
+import tracemalloc
+from types import SimpleNamespace
+
+from umodbus.client.serial import rtu
+from umodbus.client.serial.redundancy_check import add_crc
+
+from const import SensorDefinition
+from decoder import DeviceDecoder
+from pysolarmanv5.pysolarmanv5 import PySolarmanV5
+from pysolarmanv5.pysolarmanv5_async import AsyncPySolarmanV5
+from simulator import Faults, SimulatedLogger
+
+SERIAL = 1773158214
+
+
+def _definitions(count):
+    """Synthetic sensor definitions, one register each"""
+    return [
+        SimpleNamespace(
+            name=f"Sensor {i}", mb_offset=i, mb_size=2, mb_mult=0.1, mb_signed=False,
+            mb_word_order="big", mb_bitmask=None, mb_bitshift=None,
+        )
+        for i in range(count)
+    ]
+
+
+def bench_fanout():
+    """Cost per poll of handing register values to N sensors
+
+    "before" is the previous approach: rebuild dict(enumerate(raw_data)) for
+    every sensor and gather one coroutine per sensor, scaling on each access.
+    "after" decodes every sensor in one pass of the compiled DeviceDecoder.
+    """
+
+    class Sensor:
+        raw_value = None
+
+        async def async_update_value(self, value, mult):
+            self.raw_value = value * mult
+
+        def update_value(self, value):
+            self.raw_value = value
+
+    loop = asyncio.new_event_loop()
+    print(f"{'sensors':>8} {'before (us/poll)':>18} {'after (us/poll)':>18}")
+    for count in (10, 50, 100, 500, 1000):
+        definitions = _definitions(count)
+        sensors = [Sensor() for _ in definitions]
+        raw_list = list(range(count))
+        raw_data = dict(enumerate(raw_list))
+        decoder = DeviceDecoder(definitions)
+
+        async def before():
+            await asyncio.gather(*[
+                sensor.async_update_value(dict(enumerate(raw_list)).get(definition.mb_offset), definition.mb_mult)
+                for sensor, definition in zip(sensors, definitions)
+            ])
+
+        def after():
+            values = decoder.decode(raw_data)
+            for sensor, definition in zip(sensors, definitions):
+                sensor.update_value(values[definition.name])
+
+        number = max(1, 20000 // count)
+        t_before = timeit.timeit(lambda: loop.run_until_complete(before()), number=number) / number
+        t_after = timeit.timeit(after, number=number) / number
+        print(f"{count:>8} {t_before * 1e6:>18.1f} {t_after * 1e6:>18.1f}")
+    loop.close()
+
+
+class _LegacyDefinition:
+    """SensorDefinition as it was before it became a NamedTuple"""
+
+    def __init__(self, name, device_class, state_class, unit, mb_offset, mb_size=2, mb_mult=1, mb_signed=False,
+                 mb_word_order="big", mb_bitmask=None, mb_bitshift=None, poll_tier=None,
+                 deadband_abs=0, deadband_rel=0, max_silence=None, max_rate=None, daily_reset=False):
+        self.name = name
+        self.device_class = device_class
+        self.state_class = state_class
+        self.unit = unit
+        self.mb_offset = mb_offset
+        self.mb_size = mb_size
+        self.mb_mult = mb_mult
+        self.mb_signed = mb_signed
+        self.mb_word_order = mb_word_order
+        self.mb_bitmask = mb_bitmask
+        self.mb_bitshift = mb_bitshift
+        self.poll_tier = poll_tier
+        self.deadband_abs = deadband_abs
+        self.deadband_rel = deadband_rel
+        self.max_silence = max_silence
+        self.max_rate = max_rate
+        self.daily_reset = daily_reset
+
+
+class _Entity:
+    """The part of Home Assistant's Entity that serves attributes from _attr_*"""
+
+    @property
+    def device_class(self):
+        return self._attr_device_class
+
+    @property
+    def native_unit_of_measurement(self):
+        return self._attr_native_unit_of_measurement
+
+
+class _LegacySensor(_Entity):
+    """Entity attributes looked up through the definition on every access"""
+
+    def __init__(self, definition):
+        self._definition = definition
+
+    @property
+    def device_class(self):
+        return self._definition.device_class
+
+    @property
+    def native_unit_of_measurement(self):
+        return self._definition.unit
+
+
+class _Sensor(_Entity):
+    """Entity attributes set once from the definition"""
+
+    def __init__(self, definition):
+        self._attr_device_class = definition.device_class
+        self._attr_native_unit_of_measurement = definition.unit
+
+
+def _allocated(make):
+    """Bytes allocated by make(), and its result"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = make()
+    allocated = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return allocated, result
+
+
+def bench_definitions():
+    """Memory of N sensor definitions, and the cost of reading entity attributes
+
+    Memory is that of the definitions alone; names and values are shared
+    between both variants, as they are between profiles and entities.
+    """
+    print(f"{'sensors':>8} {'before (KiB)':>13} {'after (KiB)':>12} {'before (ns/read)':>17} {'after (ns/read)':>16}")
+    for count in (1000, 5000, 10000):
+        fields = [
+            dict(name=f"Sensor {i}", device_class="power", state_class="measurement", unit="W",
+                 mb_offset=i, mb_mult=0.1, deadband_rel=0.01, max_silence=300)
+            for i in range(count)
+        ]
+        m_before, legacy = _allocated(lambda: [_LegacyDefinition(**f) for f in fields])
+        m_after, current = _allocated(lambda: [SensorDefinition(**f) for f in fields])
+
+        def reads(sensors):
+            for sensor in sensors:
+                sensor.device_class
+                sensor.native_unit_of_measurement
+
+        legacy_sensors = [_LegacySensor(definition) for definition in legacy]
+        sensors = [_Sensor(definition) for definition in current]
+        number = max(1, 200000 // count)
+        t_before = timeit.timeit(lambda: reads(legacy_sensors), number=number) / number / count / 2
+        t_after = timeit.timeit(lambda: reads(sensors), number=number) / number / count / 2
+        print(f"{count:>8} {m_before / 1024:>13.0f} {m_after / 1024:>12.0f} {t_before * 1e9:>17.1f} {t_after * 1e9:>16.1f}")
+
+
+class _LegacyFrames(AsyncPySolarmanV5):
+    """The frame encoding and checksum as they were before the header template"""
+
+    @staticmethod
+    def _calculate_v5_frame_checksum(frame):
+        checksum = 0
+        for i in range(1, len(frame) - 2, 1):
+            checksum += frame[i] & 0xFF
+        return int((checksum & 0xFF))
+
+    def _v5_frame_encoder(self, modbus_frame):
+        v5_frame = bytearray(
+            self.v5_start
+            + self.v5_length
+            + self.v5_controlcode
+            + self.v5_serial
+            + self.v5_loggerserial
+            + self.v5_datafield
+            + modbus_frame
+            + self.v5_checksum
+            + self.v5_end
+        )
+        v5_frame[len(v5_frame) - 2] = self._calculate_v5_frame_checksum(v5_frame)
+        return v5_frame
+
+    def _v5_frame_decoder(self, v5_frame):
+        frame_len = len(v5_frame)
+        if (v5_frame[0] != int.from_bytes(self.v5_start, byteorder="big")) or (
+            v5_frame[frame_len - 1] != int.from_bytes(self.v5_end, byteorder="big")
+        ):
+            raise ValueError
+        if v5_frame[frame_len - 2] != self._calculate_v5_frame_checksum(v5_frame):
+            raise ValueError
+        if v5_frame[7:11] != self.v5_loggerserial:
+            raise ValueError
+        if v5_frame[3:5] != bytes.fromhex("1015"):
+            raise ValueError
+        if v5_frame[11] != int("02", 16):
+            raise ValueError
+        return v5_frame[25 : frame_len - 2]
+
+
+def _response_frame(client, quantity):
+    """A V5 response frame carrying a read of ``quantity`` holding registers"""
+    modbus_frame = add_crc(bytes([1, 3, quantity * 2]) + bytes(quantity * 2))
+    payload = bytes.fromhex("0200000000000000000000000000") + modbus_frame
+    v5_frame = bytearray(
+        client.v5_start
+        + len(payload).to_bytes(2, byteorder="little")
+        + client.v5_controlcode_response
+        + client.v5_serial
+        + client.v5_loggerserial
+        + payload
+        + client.v5_checksum
+        + client.v5_end
+    )
+    v5_frame[-2] = PySolarmanV5._calculate_v5_frame_checksum(v5_frame)
+    return bytes(v5_frame)
+
+
+def bench_frames():
+    """Frames per second through the V5 encoder and decoder"""
+    legacy = _LegacyFrames("127.0.0.1", SERIAL)
+    current = AsyncPySolarmanV5("127.0.0.1", SERIAL)
+    print(f"{'registers':>10} {'op':>8} {'before (frames/s)':>18} {'after (frames/s)':>18}")
+    for quantity in (10, 40, 125):
+        request = rtu.read_holding_registers(1, 0, quantity)
+        response = _response_frame(current, quantity)
+        for op, before, after in (
+            ("encode", lambda: legacy._v5_frame_encoder(request), lambda: current._v5_frame_encoder(request)),
+            ("decode", lambda: legacy._v5_frame_decoder(response), lambda: current._v5_frame_decoder(response)),
+        ):
+            number = 20000
+            t_before = timeit.timeit(before, number=number) / number
+            t_after = timeit.timeit(after, number=number) / number
+            print(f"{quantity:>10} {op:>8} {1 / t_before:>18,.0f} {1 / t_after:>18,.0f}")
+
+
+class _SimulatorThread:
+    """Runs simulated loggers on their own event loop, so that their work does
+    not count towards the event loop blocking measured for the clients"""
+
+    def __init__(self, count, faults):
+        self.loop = asyncio.new_event_loop()
+        self.loggers = [
+            SimulatedLogger(SERIAL + i, {i: i for i in range(512)}, faults, seed=i)
+            for i in range(count)
+        ]
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        for logger in self.loggers:
+            asyncio.run_coroutine_threadsafe(logger.start(), self.loop).result()
+        return self
+
+    def __exit__(self, *exc):
+        for logger in self.loggers:
+            asyncio.run_coroutine_threadsafe(logger.stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+
+async def _poll_fleet(loggers, duration, reads, pipeline_window=1):
+    """Poll every logger back to back for ``duration`` seconds
+
+    Returns the number of polls, the round trip time of every request, the
+    duration of every poll, and the event loop lag samples taken meanwhile.
+    """
+    round_trips = []
+    poll_times = []
+    lags = []
+    polls = 0
+    deadline = time.monotonic() + duration
+
+    async def monitor(interval=0.005):
+        while time.monotonic() < deadline:
+            expected = time.monotonic() + interval
+            await asyncio.sleep(interval)
+            lags.append(max(0.0, time.monotonic() - expected))
+
+    async def read(client, register_addr, quantity):
+        started = time.perf_counter()
+        await client.read_holding_registers(register_addr, quantity)
+        round_trips.append(time.perf_counter() - started)
+
+    async def poll(logger):
+        nonlocal polls
+        async with AsyncPySolarmanV5(
+            "127.0.0.1", logger.serial, port=logger.port, socket_timeout=5, pipeline_window=pipeline_window
+        ) as client:
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                await asyncio.gather(*(read(client, *args) for args in reads))
+                poll_times.append(time.perf_counter() - started)
+                polls += 1
+
+    await asyncio.gather(monitor(), *(poll(logger) for logger in loggers))
+    return polls, round_trips, poll_times, lags
+
+
+def bench_e2e(duration=3.0):
+    """Polls/s, round trip latency and event loop blocking against 1-50 simulated loggers
+
+    Each poll reads the LSW-3's fast tier (one block of 22 registers). Event
+    loop lag is how late a 5 ms sleep on the client loop wakes up.
+    """
+    scenarios = {
+        "clean": Faults(latency=0.02, jitter=0.01),
+        "faulty": Faults(latency=0.02, jitter=0.01, split=16, spurious=0.2),
+    }
+    reads = [(6, 22)]
+    print(f"{'scenario':>8} {'loggers':>8} {'polls/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'lag p99 ms':>11} {'lag max ms':>11}")
+    for name, faults in scenarios.items():
+        for count in (1, 10, 25, 50):
+            with _SimulatorThread(count, faults) as simulators:
+                polls, round_trips, _, lags = asyncio.run(_poll_fleet(simulators.loggers, duration, reads))
+            rtt = statistics.quantiles(round_trips, n=100)
+            lag = statistics.quantiles(lags, n=100)
+            print(
+                f"{name:>8} {count:>8} {polls / duration:>9.1f} {rtt[49] * 1e3:>8.1f} {rtt[98] * 1e3:>8.1f}"
+                f" {lag[98] * 1e3:>11.2f} {max(lags) * 1e3:>11.2f}"
+            )
+
+
+def bench_pipeline(duration=3.0):
+    """Lock-step vs. pipelined requests for polls that need several reads
+
+    10 simulated loggers with 50 ms latency, each poll reading 4 blocks.
+    """
+    reads = [(0, 20), (100, 20), (200, 20), (300, 20)]
+    print(f"{'window':>8} {'polls/s':>9} {'poll p50 ms':>12} {'poll p99 ms':>12}")
+    for window in (1, 2, 4):
+        with _SimulatorThread(10, Faults(latency=0.05, jitter=0.01)) as simulators:
+            polls, _, poll_times, _ = asyncio.run(_poll_fleet(simulators.loggers, duration, reads, window))
+        quantiles = statistics.quantiles(poll_times, n=100)
+        print(f"{window:>8} {polls / duration:>9.1f} {quantiles[49] * 1e3:>12.1f} {quantiles[98] * 1e3:>12.1f}")
+
+
+async def _concurrent_read_errors(faults, polls, reads):
+    """Poll one lock-step client with concurrent reads, counting errors by type
+
+    As LoggerConnection does, a failed read disconnects the client (while the
+    other reads of the poll are still queued on its lock), and the next poll
+    reconnects.
+    """
+    logger = await SimulatedLogger(SERIAL, {i: i for i in range(256)}, faults, seed=1).start()
+    client = AsyncPySolarmanV5("127.0.0.1", SERIAL, port=logger.port, socket_timeout=0.2)
+    errors = collections.Counter()
+
+    async def read(register_addr, quantity):
+        try:
+            await client.read_holding_registers(register_addr, quantity)
+        except Exception as err:  # pylint: disable=broad-except
+            errors[type(err).__name__] += 1
+            await client.disconnect()
+
+    try:
+        for _ in range(polls):
+            if not client.connected:
+                await client.connect()
+            await asyncio.gather(*(read(*args) for args in reads))
+    finally:
+        await client.disconnect()
+        await logger.stop()
+    return errors
+
+
+def bench_faults():
+    """Errors raised by concurrent reads on a lock-step connection under faults
+
+    Every error must be a connection error (which the integration retries or
+    defers); anything else, such as the AttributeError of a request that was
+    queued while the connection was dropped, fails the whole poll.
+    """
+    scenarios = {
+        "drop": (Faults(drop=1.0), 2),
+        "disconnect": (Faults(disconnect=0.05), 267),
+    }
+    reads = [(0, 10), (50, 10), (100, 10)]
+    for name, (faults, polls) in scenarios.items():
+        errors = asyncio.run(_concurrent_read_errors(faults, polls, reads))
+        print(f"{name:>10} {polls * len(reads):>5} reads: {dict(errors) or 'no errors'}")
+        unexpected = set(errors) - {"TimeoutError", "ConnectionError", "ConnectionResetError", "IncompleteReadError"}
+        assert not unexpected, f"Unexpected errors: {', '.join(sorted(unexpected))}"
+
+
+BENCHMARKS = {
+    "fanout": bench_fanout,
+    "definitions": bench_definitions,
+    "frames": bench_frames,
+    "e2e": bench_e2e,
+    "pipeline": bench_pipeline,
+    "faults": bench_faults,
+}
+
+
+def main():
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f"## {name}")
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,15 @@
 """Config flow for SolarMAN logger integration."""
 from __future__ import annotations
 
+import asyncio
 import logging
+import socket
 from typing import Any
-from socket import getaddrinfo, herror, gaierror, timeout
 
 import voluptuous as vol
 from voluptuous.schema_builder import Schema
+from umodbus.client.serial.redundancy_check import CRCError
+from umodbus.exceptions import ModbusError
 
 from homeassistant import config_entries
 from homeassistant.core import HomeAssistant, callback
@@ -14,19 +17,45 @@ from homeassistant.data_entry_flow import FlowResult
 from homeassistant.exceptions import HomeAssistantError
 from homeassistant.const import CONF_HOST, CONF_PORT, CONF_DEVICE, CONF_DEVICE_ID
 
-from .const import DOMAIN, SENSOR_DEFINITIONS
+from .const import (
+    DOMAIN,
+    CONF_GAP_TOLERANCE,
+    CONF_PIPELINE_WINDOW,
+    CONF_STALE_GRACE,
+    CONF_TRACE_FRAMES,
+    DEFAULT_GAP_TOLERANCE,
+    DEFAULT_PIPELINE_WINDOW,
+    DEFAULT_STALE_GRACE,
+    DEFAULT_TRACE_FRAMES,
+    DISCOVERY_TIMEOUT,
+    MAX_PIPELINE_WINDOW,
+    MAX_TRACE_FRAMES,
+    VALIDATE_TIMEOUT,
+)
+from .discovery import DiscoveredLogger, async_discover
+from .profiles import Device, SENSOR_DEFINITIONS
+from .pysolarmanv5.pysolarmanv5 import V5FrameError
+from .pysolarmanv5.pysolarmanv5_async import AsyncPySolarmanV5
 
 _LOGGER = logging.getLogger(__name__)
 
+CONF_LOGGER = "logger"
+# Choice in the discovered loggers list to enter a logger by hand
+MANUAL_ENTRY = "manual"
+
 
 def step_user_data_schema(data: dict[str, Any] = {CONF_PORT: 8899}) -> Schema:
-    _LOGGER.debug(f'config_flow.py:step_user_data_schema: {data}')
+    _LOGGER.debug('config_flow.py:step_user_data_schema: %s', data)
     STEP_USER_DATA_SCHEMA = vol.Schema(
         {
             vol.Required(CONF_HOST, default=data.get(CONF_HOST)): str,
             vol.Required(CONF_PORT, default=data.get(CONF_PORT)): int,
             vol.Required(CONF_DEVICE, default=data.get(CONF_DEVICE)): vol.In([device.name for device in SENSOR_DEFINITIONS.keys()]),
             vol.Required(CONF_DEVICE_ID, default=data.get(CONF_DEVICE_ID)): int,
+            vol.Optional(CONF_GAP_TOLERANCE, default=data.get(CONF_GAP_TOLERANCE, DEFAULT_GAP_TOLERANCE)): vol.All(int, vol.Range(min=0)),
+            vol.Optional(CONF_PIPELINE_WINDOW, default=data.get(CONF_PIPELINE_WINDOW, DEFAULT_PIPELINE_WINDOW)): vol.All(int, vol.Range(min=1, max=MAX_PIPELINE_WINDOW)),
+            vol.Optional(CONF_STALE_GRACE, default=data.get(CONF_STALE_GRACE, DEFAULT_STALE_GRACE)): vol.All(int, vol.Range(min=0)),
+            vol.Optional(CONF_TRACE_FRAMES, default=data.get(CONF_TRACE_FRAMES, DEFAULT_TRACE_FRAMES)): vol.All(int, vol.Range(min=0, max=MAX_TRACE_FRAMES)),
         }
     )
     return STEP_USER_DATA_SCHEMA
@@ -36,22 +65,45 @@ async def validate_input(hass: HomeAssistant, data: dict[str, Any]) -> dict[str,
     """Validate the user input allows us to connect.
 
     Data has the keys from STEP_USER_DATA_SCHEMA with values provided by the user.
+
+    The host is resolved on the event loop, then a single register of the
+    device is read to check that a logger answers with the given serial
+    number. Returns the entry title and the measured round trip time in ms.
     """
 
-    _LOGGER.debug(f'config_flow.py:validate_input: {data}')
+    _LOGGER.debug('config_flow.py:validate_input: %s', data)
 
     try:
-        getaddrinfo(
-            data[CONF_HOST], data[CONF_PORT], family=0, type=0, proto=0, flags=0
-        )
-    except herror:
-        raise InvalidHost
-    except gaierror:
-        raise CannotConnect
-    except timeout:
-        raise CannotConnect
+        await hass.loop.getaddrinfo(data[CONF_HOST], data[CONF_PORT], type=socket.SOCK_STREAM)
+    except (socket.herror, socket.gaierror) as err:
+        raise InvalidHost from err
 
-    return {"title": data[CONF_HOST]}
+    register = SENSOR_DEFINITIONS[Device[data[CONF_DEVICE]]][0].mb_offset
+    client = AsyncPySolarmanV5(
+        data[CONF_HOST], data[CONF_DEVICE_ID], port=data[CONF_PORT], socket_timeout=VALIDATE_TIMEOUT
+    )
+    try:
+        await client.connect()
+    except (OSError, asyncio.TimeoutError) as err:
+        raise CannotConnect from err
+    try:
+        await client.read_holding_registers(register_addr=register, quantity=1)
+    except ModbusError:
+        # A Modbus exception still came from the inverter, through a logger with this serial
+        pass
+    except asyncio.TimeoutError as err:
+        # Loggers ignore requests addressed to another serial number
+        raise InvalidSerial from err
+    except V5FrameError as err:
+        if err.reason == "serial":
+            raise InvalidSerial from err
+        raise CannotConnect from err
+    except (OSError, asyncio.IncompleteReadError, CRCError) as err:
+        raise CannotConnect from err
+    finally:
+        await client.disconnect()
+
+    return {"title": data[CONF_HOST], "rtt": round(client.metrics.rtt_last * 1000)}
 
 
 class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
@@ -59,21 +111,31 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
 
     VERSION = 1
 
+    def __init__(self) -> None:
+        self._data: dict[str, Any] = {}
+        self._info: dict[str, Any] = {}
+        self._defaults: dict[str, Any] = {CONF_PORT: 8899}
+        self._discovered: dict[int, DiscoveredLogger] | None = None
+
     @staticmethod
     @callback
     def async_get_options_flow(entry: config_entries.ConfigEntry) -> OptionsFlow:
         """Get the options flow for this handler."""
-        _LOGGER.debug(f'config_flow.py:ConfigFlow.async_get_options_flow: {entry}')
+        _LOGGER.debug('config_flow.py:ConfigFlow.async_get_options_flow: %s', entry.entry_id)
         return OptionsFlow(entry)
 
     async def async_step_user(
         self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
-        _LOGGER.debug(f'config_flow.py:ConfigFlow.async_step_user: {user_input}')
+        _LOGGER.debug('config_flow.py:ConfigFlow.async_step_user: %s', user_input)
         """Handle the initial step."""
         if user_input is None:
+            if self._discovered is None:
+                self._discovered = await self._async_discover()
+                if self._discovered:
+                    return await self.async_step_pick()
             return self.async_show_form(
-                step_id="user", data_schema=step_user_data_schema()
+                step_id="user", data_schema=step_user_data_schema(self._defaults)
             )
 
         errors = {}
@@ -84,18 +146,20 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             errors["base"] = "invalid_host"
         except CannotConnect:
             errors["base"] = "cannot_connect"
+        except InvalidSerial:
+            errors["base"] = "invalid_serial"
         except Exception:  # pylint: disable=broad-except
             _LOGGER.exception("Unexpected exception")
             errors["base"] = "unknown"
         else:
-            _LOGGER.debug(f'config_flow.py:ConfigFlow.async_step_user: validation passed: {user_input}')
+            _LOGGER.debug('config_flow.py:ConfigFlow.async_step_user: validation passed: %s', user_input)
             # await self.async_set_unique_id(user_input.device_id) # not sure this is permitted as the user can change the device_id
             # self._abort_if_unique_id_configured()
-            return self.async_create_entry(
-                title=info["title"], data=user_input, options=user_input
-            )
+            self._data = user_input
+            self._info = info
+            return await self.async_step_confirm()
 
-        _LOGGER.debug(f'config_flow.py:ConfigFlow.async_step_user: validation failed: {user_input}')
+        _LOGGER.debug('config_flow.py:ConfigFlow.async_step_user: validation failed: %s', user_input)
 
         return self.async_show_form(
             step_id="user",
@@ -103,20 +167,61 @@ class ConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
             errors=errors,
         )
 
+    async def _async_discover(self) -> dict[int, DiscoveredLogger]:
+        """Loggers answering the discovery broadcast that are not configured yet"""
+        try:
+            found = await async_discover(DISCOVERY_TIMEOUT)
+        except OSError as err:
+            _LOGGER.debug('config_flow.py:ConfigFlow._async_discover: discovery failed: %s', err)
+            return {}
+        configured = {entry.options.get(CONF_DEVICE_ID) for entry in self._async_current_entries()}
+        return {serial: logger for serial, logger in found.items() if serial not in configured}
+
+    async def async_step_pick(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Offer the discovered loggers, prefilling the form with the one picked."""
+        if user_input is None:
+            choices = {str(serial): f"{serial} ({logger.ip})" for serial, logger in self._discovered.items()}
+            choices[MANUAL_ENTRY] = "Enter manually"
+            return self.async_show_form(
+                step_id="pick",
+                data_schema=vol.Schema({vol.Required(CONF_LOGGER): vol.In(choices)}),
+            )
+        if user_input[CONF_LOGGER] != MANUAL_ENTRY:
+            logger = self._discovered[int(user_input[CONF_LOGGER])]
+            self._defaults = {CONF_HOST: logger.ip, CONF_PORT: 8899, CONF_DEVICE_ID: logger.serial}
+        return await self.async_step_user()
+
+    async def async_step_confirm(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Show the measured round trip time before creating the entry."""
+        if user_input is None:
+            return self.async_show_form(
+                step_id="confirm",
+                description_placeholders={"host": self._data[CONF_HOST], "rtt": str(self._info["rtt"])},
+            )
+        return self.async_create_entry(
+            title=self._info["title"], data=self._data, options=self._data
+        )
+
 
 class OptionsFlow(config_entries.OptionsFlow):
     """Handle options."""
 
     def __init__(self, entry: config_entries.ConfigEntry) -> None:
         """Initialize options flow."""
-        _LOGGER.debug(f'config_flow.py:OptionsFlow.__init__: {entry}')
+        _LOGGER.debug('config_flow.py:OptionsFlow.__init__: %s', entry.entry_id)
         self.entry = entry
+        self._data: dict[str, Any] = {}
+        self._info: dict[str, Any] = {}
 
     async def async_step_init(
         self, user_input: dict[str, Any] | None = None
     ) -> FlowResult:
         """Manage the options."""
-        _LOGGER.debug(f'config_flow.py:OptionsFlow.async_step_init: {user_input}')
+        _LOGGER.debug('config_flow.py:OptionsFlow.async_step_init: %s', user_input)
         if user_input is None:
             return self.async_show_form(
                 step_id="init",
@@ -131,11 +236,15 @@ class OptionsFlow(config_entries.OptionsFlow):
             errors["base"] = "invalid_host"
         except CannotConnect:
             errors["base"] = "cannot_connect"
+        except InvalidSerial:
+            errors["base"] = "invalid_serial"
         except Exception:  # pylint: disable=broad-except
             _LOGGER.exception("Unexpected exception")
             errors["base"] = "unknown"
         else:
-            return self.async_create_entry(title=info["title"], data=user_input)
+            self._data = user_input
+            self._info = info
+            return await self.async_step_confirm()
 
         return self.async_show_form(
             step_id="init",
@@ -143,6 +252,17 @@ class OptionsFlow(config_entries.OptionsFlow):
             errors=errors,
         )
 
+    async def async_step_confirm(
+        self, user_input: dict[str, Any] | None = None
+    ) -> FlowResult:
+        """Show the measured round trip time before saving the options."""
+        if user_input is None:
+            return self.async_show_form(
+                step_id="confirm",
+                description_placeholders={"host": self._data[CONF_HOST], "rtt": str(self._info["rtt"])},
+            )
+        return self.async_create_entry(title=self._info["title"], data=self._data)
+
 
 class CannotConnect(HomeAssistantError):
     """Error to indicate we cannot connect."""
@@ -150,3 +270,7 @@ class CannotConnect(HomeAssistantError):
 
 class InvalidHost(HomeAssistantError):
     """Error to indicate there is invalid hostname or IP address."""
+
+
+class InvalidSerial(HomeAssistantError):
+    """Error to indicate no logger with the given serial number answered."""
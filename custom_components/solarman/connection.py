@@ -0,0 +1,259 @@
+"""Persistent connection handling for SolarMAN data loggers."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import socket
+import time
+from enum import Enum
+
+from umodbus.client.serial.redundancy_check import CRCError
+from umodbus.exceptions import ModbusError
+
+from .pysolarmanv5.pysolarmanv5 import V5FrameError, V5FrameTrace, V5Metrics
+from .pysolarmanv5.pysolarmanv5_async import AsyncPySolarmanV5
+
+_LOGGER = logging.getLogger(__name__)
+
+# The errors a request to a logger can fail with, short of a bug
+REQUEST_ERRORS = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, V5FrameError, CRCError, ModbusError)
+
+
+class ErrorPolicy(Enum):
+    """What to do about a failed request"""
+    # A frame was corrupted on the way, but the link is fine: retry straight away
+    RETRY = "retry"
+    # The connection was reset or closed: reconnect, then retry
+    RECONNECT = "reconnect"
+    # The logger is slow or asleep: give up, and leave it for the next poll
+    DEFER = "defer"
+    # The logger refused the request (a Modbus exception): retrying won't help
+    FAIL = "fail"
+
+
+def error_policy(err: BaseException) -> ErrorPolicy:
+    """The policy for an error from REQUEST_ERRORS"""
+    if isinstance(err, (V5FrameError, CRCError)):
+        return ErrorPolicy.RETRY
+    # Before OSError: asyncio.TimeoutError is an OSError from Python 3.11
+    if isinstance(err, asyncio.TimeoutError):
+        return ErrorPolicy.DEFER
+    if isinstance(err, (OSError, asyncio.IncompleteReadError)):
+        return ErrorPolicy.RECONNECT
+    return ErrorPolicy.FAIL
+
+
+class RequestDeferred(ConnectionError):
+    """A request given up on because another request of its batch was deferred"""
+
+
+class RequestBatch:
+    """Requests made together, e.g. the reads of a poll
+
+    Once one of them is deferred (it timed out, or the logger could not be
+    connected to) the logger is taken to be slow or asleep, and the rest of
+    the batch fails straight away with RequestDeferred, without reconnecting
+    or retrying. Otherwise every request would wait out a timeout of its own.
+    """
+
+    def __init__(self) -> None:
+        self.deferred: BaseException | None = None
+
+    def check(self) -> None:
+        """Raise RequestDeferred if the batch was deferred"""
+        if self.deferred is not None:
+            raise RequestDeferred(f"Deferred after {self.deferred!r}")
+
+
+class LoggerConnection:
+    """A single long-lived connection to a data logger.
+
+    The data loggers only have a handful of TCP slots and the handshake
+    dominates the time taken by a poll, so the connection is kept open across
+    polls instead of being re-created each time. It is considered dead, and
+    re-opened on next use, when:
+
+    - a request on it fails
+    - the logger closed its end of the connection
+    - it has been idle for longer than ``idle_timeout`` seconds (the loggers
+      silently drop idle connections, leaving us with a half-open socket)
+
+    TCP keepalive is enabled on the socket so that the kernel notices dead
+    peers as well. Failed connection attempts back off exponentially between
+    ``backoff_min`` and ``backoff_max`` seconds; while backing off, requests
+    fail immediately rather than waiting out the connect timeout again.
+
+    Requests may be made concurrently; with ``pipeline_window`` > 1 the client
+    keeps up to that many of them in flight on the connection at once. A
+    failed request is retried up to ``max_retries`` times, as its
+    ErrorPolicy allows.
+
+    The traffic of every client is recorded in ``metrics``, which may be
+    passed in to keep the figures when the connection is re-created, and the
+    raw frames in ``frame_trace`` if one is given.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        serial: int,
+        *,
+        timeout: float = 10,
+        idle_timeout: float = 120,
+        backoff_min: float = 5,
+        backoff_max: float = 300,
+        pipeline_window: int = 1,
+        max_retries: int = 2,
+        metrics: V5Metrics | None = None,
+        frame_trace: V5FrameTrace | None = None,
+    ) -> None:
+        self.host = host
+        self.port = port
+        self.serial = serial
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.pipeline_window = pipeline_window
+        self.max_retries = max_retries
+        self.metrics = metrics or V5Metrics()
+        self.frame_trace = frame_trace
+
+        self.connect_count = 0
+        self.reconnect_count = 0
+        self.connect_failures = 0
+        self.request_count = 0
+        self.retry_count = 0
+
+        self._client: AsyncPySolarmanV5 | None = None
+        self._lock = asyncio.Lock()
+        self._last_activity = 0.0
+        self._consecutive_failures = 0
+        self._next_attempt = 0.0
+
+    @property
+    def connected(self) -> bool:
+        return self._client is not None and self._client.connected
+
+    def _is_healthy(self) -> bool:
+        if not self.connected:
+            return False
+        if self._client.reader.at_eof():
+            _LOGGER.debug('connection.py:LoggerConnection: %s closed by logger', self.host)
+            return False
+        if time.monotonic() - self._last_activity > self.idle_timeout:
+            _LOGGER.debug('connection.py:LoggerConnection: %s idle for too long', self.host)
+            return False
+        return True
+
+    async def _async_connect(self) -> AsyncPySolarmanV5:
+        now = time.monotonic()
+        if now < self._next_attempt:
+            raise ConnectionError(
+                f"Backing off from {self.host} for another {self._next_attempt - now:.0f}s"
+            )
+
+        client = AsyncPySolarmanV5(
+            address=self.host, serial=self.serial, port=self.port, mb_slave_id=1,
+            socket_timeout=self.timeout, pipeline_window=self.pipeline_window,
+            metrics=self.metrics, frame_trace=self.frame_trace,
+        )
+        try:
+            await client.connect()
+        except (OSError, asyncio.TimeoutError):
+            self.connect_failures += 1
+            self._consecutive_failures += 1
+            backoff = min(self.backoff_max, self.backoff_min * 2 ** (self._consecutive_failures - 1))
+            self._next_attempt = time.monotonic() + backoff
+            _LOGGER.debug('connection.py:LoggerConnection: connecting to %s failed, backing off %ss', self.host, backoff)
+            raise
+
+        sock = client.writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+        if self.connect_count:
+            self.reconnect_count += 1
+        self.connect_count += 1
+        self._consecutive_failures = 0
+        self._next_attempt = 0.0
+        self._last_activity = time.monotonic()
+        _LOGGER.debug('connection.py:LoggerConnection: connected to %s (connects: %s, reconnects: %s)', self.host, self.connect_count, self.reconnect_count)
+        return client
+
+    async def _async_drop(self) -> None:
+        client = self._client
+        self._client = None
+        if client is not None:
+            await client.disconnect()
+
+    async def _async_get_client(self, failed: AsyncPySolarmanV5 | None = None):
+        """The current client, connecting first if needed
+
+        Returns the client and whether it was connected before this call. If
+        ``failed`` is the current client it is dropped first; if another
+        request already replaced it, the replacement is used.
+        """
+        async with self._lock:
+            if failed is not None and self._client is failed:
+                await self._async_drop()
+            if self._is_healthy():
+                return self._client, True
+            await self._async_drop()
+            self._client = await self._async_connect()
+            return self._client, False
+
+    async def _async_discard(self, client: AsyncPySolarmanV5) -> None:
+        async with self._lock:
+            if self._client is client:
+                await self._async_drop()
+
+    async def async_execute(self, request, batch: RequestBatch | None = None):
+        """Run ``request(client)`` on the connection, (re)connecting as needed.
+
+        Errors are handled by their ErrorPolicy: corrupted frames are retried
+        on the same connection, a reset connection is re-opened and the
+        request retried, both at most ``max_retries`` times. Timeouts and
+        Modbus exceptions are raised straight away, for the caller to try
+        again later. A connection that timed out or was reset is dropped.
+
+        A timeout, or failing to connect, defers ``batch`` if one is given.
+        """
+        retries = 0
+        failed = None
+        batch = batch or RequestBatch()
+        while True:
+            batch.check()
+            try:
+                client, _ = await self._async_get_client(failed)
+            except REQUEST_ERRORS as err:
+                batch.deferred = batch.deferred or err
+                raise
+            failed = None
+            try:
+                self.request_count += 1
+                result = await request(client)
+            except REQUEST_ERRORS as err:
+                # The client was dropped under us because a sibling was deferred
+                batch.check()
+                policy = error_policy(err)
+                if policy in (ErrorPolicy.RECONNECT, ErrorPolicy.DEFER):
+                    failed = client
+                if policy is ErrorPolicy.DEFER:
+                    batch.deferred = err
+                if policy in (ErrorPolicy.DEFER, ErrorPolicy.FAIL) or retries >= self.max_retries:
+                    if failed is not None:
+                        await self._async_discard(failed)
+                    raise
+                retries += 1
+                self.retry_count += 1
+                _LOGGER.debug('connection.py:LoggerConnection: request to %s failed (%r), %s retry %s', self.host, err, policy.value, retries)
+                continue
+            self._last_activity = time.monotonic()
+            return result
+
+    async def async_close(self) -> None:
+        """Close the connection"""
+        async with self._lock:
+            await self._async_drop()
@@ -1,62 +1,85 @@
 """Constants for the SolarMAN logger integration."""
-from typing import Final
+from __future__ import annotations
+
+from datetime import timedelta
+from typing import Final, NamedTuple
 from enum import Enum
 
 DOMAIN = "solarman-modbus"
 
-SENSOR_VDC1: Final = "Voltage DC1"
-SENSOR_IDC1: Final = "Current DC1"
-SENSOR_VDC2: Final = "Voltage DC2"
-SENSOR_IDC2: Final = "Current DC2"
-SENSOR_VAC: Final = "Voltage AC"
-SENSOR_IAC: Final = "Current AC"
-SENSOR_FREQ: Final = "Frequency"
-SENSOR_TEMP: Final = "Temperature"
-SENSOR_PWR: Final = "Power"
-SENSOR_ENERGY_DAY: Final = "Energy Today"
-SENSOR_ENERGY_TOT: Final = "Energy Total"
-SENSOR_HRS: Final = "Hours Total"
-
-from homeassistant.const import (
-    ELECTRIC_POTENTIAL_VOLT,
-    ELECTRIC_CURRENT_AMPERE,
-    POWER_WATT,
-    POWER_KILO_WATT,
-    TEMP_CELSIUS,
-    FREQUENCY_HERTZ,
-    ENERGY_KILO_WATT_HOUR,
-    TIME_HOURS
-)
-
-from homeassistant.components.sensor import (
-    SensorDeviceClass,
-    STATE_CLASS_MEASUREMENT,
-    STATE_CLASS_TOTAL_INCREASING,
-)
-
-
-class Device(Enum):
-    LSW3 = 'LSW-3'
-
-class Sensor(Enum):
-    VDC1 = "Voltage DC1"
-    IDC1 = "Current DC1"
-    PDC1 = "Power DC1"
-    VDC2 = "Voltage DC2"
-    IDC2 = "Current DC2"
-    PDC2 = "Power DC2"
-    VAC = "Voltage AC"
-    IAC = "Current AC"
-    FREQ = "Frequency"
-    TEMP = "Temperature"
-    PWR = "Power"
-    ENERGY_DAY = "Energy Today"
-    ENERGY_TOT = "Energy Total"
-    HRS = "Hours Total"
-
-class SensorDefinition:
+CONF_DISCOVERY_INTERVAL: Final = "discovery_interval"
+CONF_GAP_TOLERANCE: Final = "gap_tolerance"
+CONF_MAX_CONCURRENCY: Final = "max_concurrency"
+CONF_PIPELINE_WINDOW: Final = "pipeline_window"
+CONF_STALE_GRACE: Final = "stale_grace"
+CONF_TRACE_FRAMES: Final = "trace_frames"
+
+# Key of the FleetPoller in hass.data[DOMAIN]; the other keys are config entry ids
+DATA_FLEET: Final = "fleet"
+
+SERVICE_WRITE_REGISTERS: Final = "write_registers"
+ATTR_SERIAL: Final = "serial"
+ATTR_REGISTERS: Final = "registers"
+ATTR_VERIFY: Final = "verify"
+
+# The most loggers polled at the same time
+DEFAULT_MAX_CONCURRENCY: Final = 4
+
+# The most registers a single Modbus read may request
+MODBUS_MAX_REGISTERS: Final = 125
+# The most registers a single Modbus 'write multiple registers' request may carry
+MODBUS_MAX_WRITE_REGISTERS: Final = 123
+# Unused registers tolerated between two sensors before splitting a read
+DEFAULT_GAP_TOLERANCE: Final = 16
+# Requests in flight at once on a logger connection; 1 is lock-step
+DEFAULT_PIPELINE_WINDOW: Final = 1
+MAX_PIPELINE_WINDOW: Final = 8
+# Raw frames kept per logger for troubleshooting; 0 disables tracing
+DEFAULT_TRACE_FRAMES: Final = 0
+MAX_TRACE_FRAMES: Final = 500
+# Seconds past its next scheduled read that a value is kept when reads fail,
+# shown as stale, before its sensor becomes unavailable
+DEFAULT_STALE_GRACE: Final = 300
+
+# Seconds to wait for the logger when validating a configuration
+VALIDATE_TIMEOUT: Final = 5
+# Seconds to collect answers to the discovery broadcast
+DISCOVERY_TIMEOUT: Final = 2
+# Minutes between rescans for loggers that changed address; 0 disables
+DEFAULT_DISCOVERY_INTERVAL: Final = 15
+
+# Version of the stored register snapshot of each logger
+STORAGE_VERSION: Final = 1
+# Seconds to gather snapshot changes before saving them
+SNAPSHOT_SAVE_DELAY: Final = 60
+# Register blocks kept in each logger's history file
+HISTORY_RECORDS: Final = 4096
+# The most recent of those included in the diagnostics download
+HISTORY_DIAGNOSTICS_RECORDS: Final = 50
+
+# Seconds a poll may take before the coordinator gives up on it
+POLL_TIMEOUT: Final = 60
+# Seconds the reads of a poll may take in all; less than POLL_TIMEOUT, so that
+# the reads still unfinished are failed, and the poll recorded, in time
+POLL_READ_TIMEOUT: Final = 45
+
+# Consecutive failed polls after which the logger is assumed asleep (e.g. at night)
+SLEEP_AFTER_FAILURES: Final = 3
+# The longest to wait between polls while the logger is asleep
+MAX_SLEEP_INTERVAL: Final = timedelta(minutes=10)
+
+class PollTier(Enum):
+    """How often a sensor is read, in seconds"""
+    FAST = 30
+    MEDIUM = 60
+    SLOW = 300
+
+class SensorDefinition(NamedTuple):
     """A definition of a sensor
 
+    Definitions are immutable and compact (no per-instance __dict__), so a
+    single instance is shared by the entities of every inverter of a device.
+
     :param name: The human-readable name of the sensor
     :param device_class: The HomeAssistant class of the device, e.g. DEVICE_CLASS_VOLTAGE
     :param state_class: The HomeAssistant class of the device's state, e.g. STATE_CLASS_MEASUREMENT for one-off measurements or STATE_CLASS_TOTAL_INCREASING for measurements that count up
@@ -64,154 +87,63 @@ class SensorDefinition:
     :param mb_offset: The modbus register offset for this sensor reading
     :param mb_size: The size of this sensor reading in bytes in the modbus response. Most sensor readings are 2-bytes, some are more.
     :param mb_mult: A multiplier to apply to the raw modbus value to convert it into the appropriate units.
+    :param mb_signed: Whether the raw modbus value is a two's complement signed value.
+    :param mb_word_order: For values spanning several registers, 'big' if the most significant register comes first, 'little' if it comes last.
+    :param mb_bitmask: A bitmask to apply to the raw modbus value, e.g. to extract flags.
+    :param mb_bitshift: A number of bits to shift the raw modbus value right by, after masking.
+    :param poll_tier: How often to read the sensor; fast-changing readings like power use PollTier.FAST, slow-moving totals PollTier.SLOW.
+    :param deadband_abs: Changes in value no larger than this are not written to Home Assistant's state, to spare the recorder.
+    :param deadband_rel: As deadband_abs, but as a fraction of the last written value, e.g. 0.01 for 1%.
+    :param max_silence: Seconds after which a changed value is written even if within the deadband.
+    :param max_rate: For STATE_CLASS_TOTAL_INCREASING sensors, the largest plausible increase per hour; readings that rise faster are rejected.
+    :param daily_reset: For STATE_CLASS_TOTAL_INCREASING sensors, whether the counter is reset every day; a drop is then accepted when the day has changed.
+    """
+    name: str
+    device_class: str | None
+    state_class: str | None
+    unit: str | None
+    mb_offset: int
+    mb_size: int = 2
+    mb_mult: float = 1
+    mb_signed: bool = False
+    mb_word_order: str = "big"
+    mb_bitmask: int | None = None
+    mb_bitshift: int | None = None
+    poll_tier: PollTier = PollTier.FAST
+    deadband_abs: float = 0
+    deadband_rel: float = 0
+    max_silence: int | None = None
+    max_rate: float | None = None
+    daily_reset: bool = False
+
+class DerivedDefinition(NamedTuple):
+    """A definition of a sensor computed from the values of other sensors
+
+    Derived sensors need no Modbus reads of their own. The entity attributes
+    are as for SensorDefinition.
+
+    :param name: The human-readable name of the sensor
+    :param device_class: The HomeAssistant class of the device
+    :param state_class: The HomeAssistant class of the device's state
+    :param unit: The units of the value
+    :param kind: How the value is computed: 'product', 'sum' or 'ratio' of the inputs, or the 'integral' of a single input over time, in input × hours
+    :param inputs: The names of the sensors (or derived sensors declared earlier) the value is computed from
+    :param scale: A multiplier applied to the result, or to the input of an integral, e.g. 0.001 to integrate W into kWh
+    :param precision: The number of decimals to round the value to, if any
+    :param max_gap: For integrals, the longest gap in seconds between two readings that is integrated over
+    :param deadband_abs: As for SensorDefinition
+    :param deadband_rel: As for SensorDefinition
+    :param max_silence: As for SensorDefinition
     """
-    def __init__(
-        self,
-        name: str,
-        device_class: str,
-        state_class: str,
-        unit: str,
-        mb_offset: int,
-        mb_size: int = 2,
-        mb_mult: int = 1
-    ):
-        self.name = name
-        self.device_class = device_class
-        self.state_class = state_class
-        self.unit = unit
-        self.mb_offset = mb_offset
-        self.mb_size = mb_size
-        self.mb_mult = mb_mult
-
-# NB: device sensors MUST be in order of mb_offset
-SENSOR_DEFINITIONS: Final = {
-    Device.LSW3: [
-        SensorDefinition(
-            name=Sensor.VDC1.value,
-            device_class=SensorDeviceClass.VOLTAGE,
-            state_class=STATE_CLASS_MEASUREMENT,
-            unit=ELECTRIC_POTENTIAL_VOLT,
-            mb_offset=6,
-            mb_size=2,
-            mb_mult=0.1,
-        ),
-        SensorDefinition(
-            name=Sensor.IDC1.value,
-            device_class=SensorDeviceClass.CURRENT,
-            state_class=STATE_CLASS_MEASUREMENT,
-            unit=ELECTRIC_CURRENT_AMPERE,
-            mb_offset=7,
-            mb_size=2,
-            mb_mult=0.01,
-        ),
-        SensorDefinition(
-            name=Sensor.VDC2.value,
-            device_class=SensorDeviceClass.VOLTAGE,
-            state_class=STATE_CLASS_MEASUREMENT,
-            unit=ELECTRIC_POTENTIAL_VOLT,
-            mb_offset=8,
-            mb_size=2,
-            mb_mult=0.1,
-        ),
-        SensorDefinition(
-            name=Sensor.IDC2.value,
-            device_class=SensorDeviceClass.CURRENT,
-            state_class=STATE_CLASS_MEASUREMENT,
-            unit=ELECTRIC_CURRENT_AMPERE,
-            mb_offset=9,
-            mb_size=2,
-            mb_mult=0.01,
-        ),
-        SensorDefinition(
-            name=Sensor.PDC1.value,
-            device_class=SensorDeviceClass.POWER,
-            state_class=STATE_CLASS_MEASUREMENT,
-            unit=POWER_WATT,
-            mb_offset=10,
-            mb_size=2,
-            mb_mult=10,
-        ),
-        SensorDefinition(
-            name=Sensor.PDC2.value,
-            device_class=SensorDeviceClass.POWER,
-            state_class=STATE_CLASS_MEASUREMENT,
-            unit=POWER_WATT,
-            mb_offset=11,
-            mb_size=2,
-            mb_mult=10,
-        ),
-        SensorDefinition(
-            name=Sensor.PWR.value,
-            device_class=SensorDeviceClass.POWER,
-            state_class=STATE_CLASS_MEASUREMENT,
-            unit=POWER_KILO_WATT,
-            mb_offset=12, # might be 14, need to check this
-            mb_size=2,
-            mb_mult=0.01,
-        ),
-        SensorDefinition(
-            name=Sensor.FREQ.value,
-            device_class=SensorDeviceClass.FREQUENCY,
-            state_class=STATE_CLASS_MEASUREMENT,
-            unit=FREQUENCY_HERTZ,
-            mb_offset=14,
-            mb_size=2,
-            mb_mult=0.01,
-        ),
-        SensorDefinition(
-            name=Sensor.VAC.value,
-            device_class=SensorDeviceClass.VOLTAGE,
-            state_class=STATE_CLASS_MEASUREMENT,
-            unit=ELECTRIC_POTENTIAL_VOLT,
-            mb_offset=15,
-            mb_size=2,
-            mb_mult=0.1,
-        ),
-        SensorDefinition(
-            name=Sensor.IAC.value,
-            device_class=SensorDeviceClass.CURRENT,
-            state_class=STATE_CLASS_MEASUREMENT,
-            unit=ELECTRIC_CURRENT_AMPERE,
-            mb_offset=16,
-            mb_size=2,
-            mb_mult=0.01,
-        ),
-        SensorDefinition(
-            name=Sensor.ENERGY_TOT.value,
-            device_class=SensorDeviceClass.ENERGY,
-            state_class=STATE_CLASS_TOTAL_INCREASING,
-            unit=ENERGY_KILO_WATT_HOUR,
-            mb_offset=22,
-            mb_size=4,
-            mb_mult=1,
-        ),
-        SensorDefinition(
-            name=Sensor.HRS.value,
-            device_class=None,
-            state_class=STATE_CLASS_TOTAL_INCREASING,
-            unit=TIME_HOURS,
-            mb_offset=24,
-            mb_size=4,
-            mb_mult=1,
-        ),
-        SensorDefinition(
-            name=Sensor.ENERGY_DAY.value,
-            device_class=SensorDeviceClass.ENERGY,
-            state_class=STATE_CLASS_TOTAL_INCREASING,
-            unit=ENERGY_KILO_WATT_HOUR,
-            mb_offset=25,
-            mb_size=2,
-            mb_mult=0.01,
-        ),
-        SensorDefinition(
-            name=Sensor.TEMP.value,
-            device_class=SensorDeviceClass.TEMPERATURE,
-            state_class=STATE_CLASS_MEASUREMENT,
-            unit=TEMP_CELSIUS,
-            mb_offset=27,
-            mb_size=2,
-            mb_mult=1,
-        ),
-
-    ]
-}
\ No newline at end of file
+    name: str
+    device_class: str | None
+    state_class: str | None
+    unit: str | None
+    kind: str
+    inputs: tuple[str, ...]
+    scale: float = 1
+    precision: int | None = None
+    max_gap: int = 600
+    deadband_abs: float = 0
+    deadband_rel: float = 0
+    max_silence: int | None = None
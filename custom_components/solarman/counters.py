@@ -0,0 +1,126 @@
+"""Reject implausible readings of counters that only ever go up."""
+from __future__ import annotations
+
+import logging
+from collections.abc import Callable
+from datetime import date
+from typing import TYPE_CHECKING
+
+from .planner import register_count
+
+if TYPE_CHECKING:
+    from .const import SensorDefinition
+
+_LOGGER = logging.getLogger(__name__)
+
+STATE_CLASS_TOTAL_INCREASING = "total_increasing"
+# Consecutive rejected readings after which a counter's reading is taken as
+# its new baseline, e.g. after the inverter was replaced
+MAX_CONSECUTIVE_REJECTIONS = 5
+
+
+class _Counter:
+    """The last plausible reading of a counter"""
+
+    __slots__ = ("value", "read_at", "checked_at", "held", "rejected", "consecutive")
+
+    def __init__(self) -> None:
+        self.value: float | None = None
+        self.read_at: float | None = None
+        # When the reading last checked was read, so that a reading served
+        # again from the snapshot is not checked (or counted) twice
+        self.checked_at: float | None = None
+        self.held = False
+        self.rejected = 0
+        self.consecutive = 0
+
+
+class CounterFilter:
+    """Holds back implausible readings of a device's total_increasing sensors
+
+    Home Assistant's long-term statistics take any drop in such a sensor as a
+    meter reset, so a single misread frame can corrupt energy statistics for
+    days. A reading is rejected, and the last plausible one held instead, if
+
+    - it is lower than the last one, unless the sensor resets daily and the
+      day has changed in between
+    - it rose by more than the sensor's max_rate per hour allows for the time
+      since the last one, plus a step of the register's resolution
+
+    Rejected readings are logged with their raw registers and counted per
+    sensor. After MAX_CONSECUTIVE_REJECTIONS in a row the reading is accepted
+    as the counter's new baseline, so a counter that really was reset is not
+    held forever.
+    """
+
+    def __init__(
+        self,
+        definitions: list[SensorDefinition],
+        label: str = "",
+        day: Callable[[float], date] = date.fromtimestamp,
+    ) -> None:
+        self.definitions = tuple(
+            definition for definition in definitions if definition.state_class == STATE_CLASS_TOTAL_INCREASING
+        )
+        self.label = label
+        self._day = day
+        self._counters = {definition.name: _Counter() for definition in self.definitions}
+
+    @property
+    def rejected(self) -> dict[str, int]:
+        """The number of readings rejected, by sensor name"""
+        return {name: counter.rejected for name, counter in self._counters.items()}
+
+    @property
+    def rejected_count(self) -> int:
+        return sum(counter.rejected for counter in self._counters.values())
+
+    def _implausible(self, definition: SensorDefinition, counter: _Counter, value: float, read_at: float) -> str | None:
+        """Why a reading is implausible; None if it is not"""
+        if value < counter.value:
+            if definition.daily_reset and self._day(read_at) != self._day(counter.read_at):
+                return None
+            return "dropped"
+        if definition.max_rate is not None:
+            allowed = definition.max_rate * (read_at - counter.read_at) / 3600 + abs(definition.mb_mult)
+            if value - counter.value > allowed:
+                return "jumped"
+        return None
+
+    def check(self, values: dict[str, int | float | None], timestamps: dict[str, float | None], registers: dict[int, int]) -> None:
+        """Replace implausible readings in ``values`` with the last plausible ones
+
+        ``timestamps`` holds when each sensor was read, and ``registers`` the
+        raw registers the values were decoded from, for logging.
+        """
+        for definition in self.definitions:
+            name = definition.name
+            value = values.get(name)
+            read_at = timestamps.get(name)
+            if value is None or read_at is None:
+                continue
+            counter = self._counters[name]
+            if read_at == counter.checked_at:
+                if counter.held:
+                    values[name] = counter.value
+                continue
+            counter.checked_at = read_at
+
+            reason = None if counter.value is None else self._implausible(definition, counter, value, read_at)
+            if reason is not None:
+                counter.rejected += 1
+                counter.consecutive += 1
+                raw = " ".join(
+                    f"{registers.get(offset, 0):04X}"
+                    for offset in range(definition.mb_offset, definition.mb_offset + register_count(definition))
+                )
+                if counter.consecutive < MAX_CONSECUTIVE_REJECTIONS:
+                    _LOGGER.warning('Rejected reading of %s %s: %s from %s to %s in %.0fs (registers 0x%04X: %s)', self.label, name, reason, counter.value, value, read_at - counter.read_at, definition.mb_offset, raw)
+                    values[name] = counter.value
+                    counter.held = True
+                    continue
+                _LOGGER.warning('Accepting reading of %s %s as its new baseline after %s rejections: %s (registers 0x%04X: %s)', self.label, name, counter.consecutive, value, definition.mb_offset, raw)
+            counter.value = value
+            counter.read_at = read_at
+            counter.held = False
+            counter.consecutive = 0
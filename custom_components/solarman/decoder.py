@@ -0,0 +1,95 @@
+"""Decode raw register values into sensor values."""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, NamedTuple
+
+if TYPE_CHECKING:
+    from .const import SensorDefinition
+
+WORD_ORDER_BIG = "big"
+WORD_ORDER_LITTLE = "little"
+
+
+class _Field(NamedTuple):
+    """A sensor definition compiled down to what is needed to decode it"""
+    name: str
+    offsets: tuple[int, ...]
+    shifts: tuple[int, ...]
+    sign_bit: int
+    bitmask: int | None
+    bitshift: int | None
+    scale: float
+    divisor: int | None
+
+
+def _compile(definition: SensorDefinition) -> _Field:
+    count = max(1, (definition.mb_size + 1) // 2)
+    offsets = tuple(range(definition.mb_offset, definition.mb_offset + count))
+    # The shift applied to each register when combining them into one value
+    shifts = tuple(16 * i for i in range(count))
+    if definition.mb_word_order == WORD_ORDER_BIG:
+        shifts = shifts[::-1]
+    elif definition.mb_word_order != WORD_ORDER_LITTLE:
+        raise ValueError(f"Sensor {definition.name} has invalid word order {definition.mb_word_order}")
+    scale = definition.mb_mult
+    # Fractional scales like 0.1 are applied by dividing by 10 instead, which
+    # avoids float noise (2345 * 0.1 gives 234.50000000000003, 2345 / 10 does not)
+    divisor = None
+    if 0 < abs(scale) < 1 and abs(1 / scale - round(1 / scale)) < 1e-9:
+        divisor = round(1 / scale)
+    return _Field(
+        name=definition.name,
+        offsets=offsets,
+        shifts=shifts,
+        sign_bit=1 << (16 * count - 1) if definition.mb_signed else 0,
+        bitmask=definition.mb_bitmask,
+        bitshift=definition.mb_bitshift,
+        scale=scale,
+        divisor=divisor,
+    )
+
+
+class DeviceDecoder:
+    """Converts the registers read from a device into sensor values
+
+    Compiled once per device from its sensor definitions and shared by all
+    entities of that device. Each value is assembled from mb_size bytes of
+    registers in the given word order, then sign-converted, masked, shifted
+    and finally scaled by mb_mult.
+    """
+
+    def __init__(self, definitions: list[SensorDefinition]) -> None:
+        self.names = tuple(definition.name for definition in definitions)
+        self._fields = tuple(_compile(definition) for definition in definitions)
+
+    def decode(self, raw_data: dict[int, int]) -> dict[str, int | float | None]:
+        """Decode every sensor in a single pass over the compiled table
+
+        Sensors whose registers were not (all) read are given None.
+        """
+        get = raw_data.get
+        values = {}
+        for field in self._fields:
+            if len(field.offsets) == 1:
+                value = get(field.offsets[0])
+            else:
+                value = 0
+                for offset, shift in zip(field.offsets, field.shifts):
+                    register = get(offset)
+                    if register is None:
+                        value = None
+                        break
+                    value |= register << shift
+            if value is not None:
+                if field.sign_bit and value & field.sign_bit:
+                    value -= field.sign_bit << 1
+                if field.bitmask is not None:
+                    value &= field.bitmask
+                if field.bitshift is not None:
+                    value >>= field.bitshift
+                if field.divisor is not None:
+                    value /= field.divisor
+                elif field.scale != 1:
+                    value *= field.scale
+            values[field.name] = value
+        return values
@@ -0,0 +1,102 @@
+"""Compute sensors derived from the values of other sensors."""
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .const import DerivedDefinition
+
+KIND_PRODUCT = "product"
+KIND_SUM = "sum"
+KIND_RATIO = "ratio"
+KIND_INTEGRAL = "integral"
+
+# Kind: (fewest inputs, most inputs or None for any number)
+DERIVED_KINDS = {
+    KIND_PRODUCT: (2, None),
+    KIND_SUM: (1, None),
+    KIND_RATIO: (2, 2),
+    KIND_INTEGRAL: (1, 1),
+}
+
+
+class _Integral:
+    """The trapezoidal integral of a value over time, in value × hours
+
+    Only the running total and the last sample are kept, so each update is
+    O(1). A sample read at the same time as the last one (e.g. a stale value
+    served again) is not counted twice, and gaps longer than ``max_gap``
+    seconds, or without a value, are not integrated over.
+    """
+
+    __slots__ = ("total", "_value", "_time")
+
+    def __init__(self, total: float = 0.0) -> None:
+        self.total = total
+        self._value: float | None = None
+        self._time: float | None = None
+
+    def update(self, value: float | None, timestamp: float | None, max_gap: float) -> float:
+        if value is None or timestamp is None:
+            self._value = None
+            return self.total
+        if timestamp == self._time:
+            return self.total
+        if self._value is not None and 0 < timestamp - self._time <= max_gap:
+            self.total += (self._value + value) / 2 * (timestamp - self._time) / 3600
+        self._value, self._time = value, timestamp
+        return self.total
+
+
+class DerivedEngine:
+    """Computes a device's derived sensors from its decoded values on every poll
+
+    Derived sensors are computed in the order they are declared, so one may
+    use another declared before it. A derived value is None if any of its
+    inputs is. Integrals carry state between polls, which can be saved with
+    state() and restored with restore().
+    """
+
+    def __init__(self, definitions: list[DerivedDefinition]) -> None:
+        self.definitions = tuple(definitions)
+        self._integrals = {
+            definition.name: _Integral() for definition in definitions if definition.kind == KIND_INTEGRAL
+        }
+
+    def update(self, values: dict[str, int | float | None], timestamps: dict[str, float | None]) -> None:
+        """Add the derived values to ``values``
+
+        ``timestamps`` holds when each input was read; the time of a derived
+        value is that of its most recently read input.
+        """
+        for definition in self.definitions:
+            inputs = [values.get(name) for name in definition.inputs]
+            read_at = [timestamps.get(name) for name in definition.inputs]
+            timestamps[definition.name] = max((t for t in read_at if t is not None), default=None)
+            value = None
+            if definition.kind == KIND_INTEGRAL:
+                integral = self._integrals[definition.name]
+                sample = None if inputs[0] is None else inputs[0] * definition.scale
+                value = integral.update(sample, timestamps[definition.name], definition.max_gap)
+            elif None not in inputs:
+                if definition.kind == KIND_PRODUCT:
+                    value = definition.scale
+                    for input_value in inputs:
+                        value *= input_value
+                elif definition.kind == KIND_SUM:
+                    value = sum(inputs) * definition.scale
+                elif definition.kind == KIND_RATIO and inputs[1]:
+                    value = inputs[0] / inputs[1] * definition.scale
+            if value is not None and definition.precision is not None:
+                value = round(value, definition.precision)
+            values[definition.name] = value
+
+    def state(self) -> dict[str, float]:
+        """The running totals of the integrals, as JSON-serialisable data"""
+        return {name: integral.total for name, integral in self._integrals.items()}
+
+    def restore(self, state: dict[str, float]) -> None:
+        """Restore running totals saved with state()"""
+        for name, total in state.items():
+            if name in self._integrals:
+                self._integrals[name].total = total
@@ -0,0 +1,25 @@
+"""Diagnostics support for the SolarMAN logger integration."""
+from __future__ import annotations
+
+from dataclasses import asdict
+from typing import Any
+
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN, DATA_FLEET
+
+
+async def async_get_config_entry_diagnostics(hass: HomeAssistant, entry: ConfigEntry) -> dict[str, Any]:
+    """Connection, traffic and polling figures of a logger
+
+    Download one for each logger of a fleet to compare round trip times,
+    frame errors and timeouts between sticks.
+    """
+    inverter = hass.data[DOMAIN].get(entry.entry_id)
+    latency = hass.data[DOMAIN][DATA_FLEET].latency.get(entry.entry_id)
+    return {
+        "options": dict(entry.options),
+        "inverter": inverter.diagnostics() if inverter is not None else None,
+        "poll_latency": asdict(latency) if latency is not None else None,
+    }
@@ -0,0 +1,75 @@
+"""Find data loggers on the local network."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import socket
+from dataclasses import dataclass
+
+_LOGGER = logging.getLogger(__name__)
+
+DISCOVERY_PORT = 48899
+DISCOVERY_MESSAGE = b"WIFIKIT-214028-READ"
+BROADCAST_ADDRESS = "255.255.255.255"
+
+
+@dataclass(frozen=True)
+class DiscoveredLogger:
+    """A data logger that answered the discovery broadcast
+
+    :param ip: The IP address the logger reported
+    :param mac: The MAC address of the logger
+    :param serial: The serial number of the logger
+    """
+    ip: str
+    mac: str
+    serial: int
+
+
+def parse_response(data: bytes) -> DiscoveredLogger | None:
+    """Parse an 'ip,mac,serial' answer; None if it is not one (e.g. our own broadcast)"""
+    try:
+        ip, mac, serial = data.decode("ascii").strip().split(",")
+        return DiscoveredLogger(ip=ip, mac=mac, serial=int(serial))
+    except ValueError:
+        return None
+
+
+class _DiscoveryProtocol(asyncio.DatagramProtocol):
+    """Collects the answers to the discovery broadcast, by serial number"""
+
+    def __init__(self) -> None:
+        self.loggers: dict[int, DiscoveredLogger] = {}
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        logger = parse_response(data)
+        if logger is not None:
+            self.loggers[logger.serial] = logger
+
+    def error_received(self, exc: Exception) -> None:
+        _LOGGER.debug('discovery.py:_DiscoveryProtocol: %s', exc)
+
+
+async def async_discover(
+    timeout: float,
+    address: str = BROADCAST_ADDRESS,
+    port: int = DISCOVERY_PORT,
+) -> dict[int, DiscoveredLogger]:
+    """Broadcast the discovery message and collect answers for ``timeout`` seconds
+
+    All loggers answer at once, so the answers are simply collected as they
+    arrive. The broadcast is repeated halfway through, in case a datagram was
+    lost. Returns the loggers found, keyed by serial number.
+    """
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        _DiscoveryProtocol, family=socket.AF_INET, allow_broadcast=True
+    )
+    try:
+        for _ in range(2):
+            transport.sendto(DISCOVERY_MESSAGE, (address, port))
+            await asyncio.sleep(timeout / 2)
+    finally:
+        transport.close()
+    _LOGGER.debug('discovery.py:async_discover: found %s', list(protocol.loggers.values()))
+    return protocol.loggers
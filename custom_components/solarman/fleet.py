@@ -0,0 +1,120 @@
+"""Coordinate polling across all configured data loggers."""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from homeassistant.core import HomeAssistant, callback
+from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.update_coordinator import DataUpdateCoordinator
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _stagger_fraction(slot: int) -> float:
+    """Van der Corput sequence: 0, 1/2, 1/4, 3/4, 1/8, ...
+
+    Successive slots always land in the largest remaining gap, so loggers
+    are spread evenly over the interval however many there are.
+    """
+    fraction, denominator = 0.0, 1
+    while slot:
+        denominator *= 2
+        slot, bit = divmod(slot, 2)
+        fraction += bit / denominator
+    return fraction
+
+
+@dataclass
+class LoggerLatency:
+    """Poll timings of a single logger, in seconds
+
+    :param polls: The number of polls made
+    :param last: Duration of the last poll
+    :param average: Exponential moving average of the poll duration
+    :param max: Longest poll seen
+    :param last_wait: Time the last poll waited for a free concurrency slot
+    """
+    polls: int = 0
+    last: float = 0.0
+    average: float = 0.0
+    max: float = 0.0
+    last_wait: float = 0.0
+
+    def record(self, duration: float, wait: float) -> None:
+        self.polls += 1
+        self.last = duration
+        self.average = duration if self.polls == 1 else 0.8 * self.average + 0.2 * duration
+        self.max = max(self.max, duration)
+        self.last_wait = wait
+
+
+class FleetPoller:
+    """Shared by all config entries, so that many loggers poll well together
+
+    - At most ``max_concurrency`` loggers are polled at once; the rest wait
+      for a free slot rather than all hitting the network at the same tick.
+    - Each logger is given a slot, and its coordinator is nudged so that its
+      polls are offset into the interval by that slot's share, spreading the
+      polls of the fleet evenly instead of bunching them at the same instant.
+    - Per-logger poll latency is recorded, so slow loggers can be found.
+    """
+
+    def __init__(self, hass: HomeAssistant, max_concurrency: int) -> None:
+        self._hass = hass
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._slots: dict[str, int] = {}
+        self._unsub_stagger: dict[str, Callable[[], None]] = {}
+        self.latency: dict[str, LoggerLatency] = {}
+
+    def register(self, entry_id: str) -> None:
+        """Add a logger to the fleet, giving it the lowest free stagger slot"""
+        used = set(self._slots.values())
+        self._slots[entry_id] = next(slot for slot in range(len(used) + 1) if slot not in used)
+        self.latency[entry_id] = LoggerLatency()
+
+    @callback
+    def unregister(self, entry_id: str) -> None:
+        """Remove a logger from the fleet"""
+        unsub = self._unsub_stagger.pop(entry_id, None)
+        if unsub is not None:
+            unsub()
+        self._slots.pop(entry_id, None)
+        self.latency.pop(entry_id, None)
+
+    @callback
+    def async_stagger(self, entry_id: str, coordinator: DataUpdateCoordinator) -> None:
+        """Shift a coordinator's polls to its slot's offset into the interval
+
+        A coordinator schedules its next poll one interval after the previous
+        one finished, so a single out-of-band refresh at the offset moves all
+        of its following polls.
+        """
+        delay = _stagger_fraction(self._slots[entry_id]) * coordinator.update_interval.total_seconds()
+        if not delay:
+            return
+        _LOGGER.debug('fleet.py:FleetPoller.async_stagger: delaying %s by %.1fs', entry_id, delay)
+
+        @callback
+        def _refresh(_now) -> None:
+            self._unsub_stagger.pop(entry_id, None)
+            self._hass.async_create_task(coordinator.async_refresh())
+
+        self._unsub_stagger[entry_id] = async_call_later(self._hass, delay, _refresh)
+
+    async def async_poll(self, entry_id: str, poll):
+        """Run ``poll()`` for a logger within the fleet's concurrency limit"""
+        queued = time.monotonic()
+        async with self._semaphore:
+            started = time.monotonic()
+            try:
+                return await poll()
+            finally:
+                latency = self.latency.get(entry_id)
+                if latency is not None:
+                    latency.record(time.monotonic() - started, started - queued)
+                    _LOGGER.debug('fleet.py:FleetPoller.async_poll: %s polled in %.3fs (waited %.3fs, average %.3fs)', entry_id, latency.last, latency.last_wait, latency.average)
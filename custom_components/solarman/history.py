@@ -0,0 +1,147 @@
+"""Keep the recent register blocks of a logger in a fixed-size file."""
+from __future__ import annotations
+
+import logging
+import mmap
+import os
+import struct
+from collections.abc import Iterator
+from pathlib import Path
+from typing import NamedTuple
+
+_LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"SMRH"
+VERSION = 1
+# magic, version, registers per record, capacity, next record, records written
+_HEADER = struct.Struct("<4sHHIII")
+HEADER_SIZE = 32
+
+
+class HistoryRecord(NamedTuple):
+    """A register block as it was read
+
+    :param timestamp: When the block was read, in seconds since the epoch
+    :param start: The first register of the block
+    :param values: The values of the registers from start on
+    """
+    timestamp: float
+    start: int
+    values: tuple[int, ...]
+
+
+class RegisterHistory:
+    """A ring buffer of the register blocks read from a logger, in a file
+
+    The file holds a header followed by ``capacity`` fixed-size records, each
+    with room for ``slots`` registers: the largest block the logger is read
+    in. It is memory-mapped, so adding a record
+    is a copy into the page cache that the kernel writes back in its own time,
+    and nothing is lost when Home Assistant exits without closing it. Once the
+    buffer is full the oldest record is overwritten. A file with a different
+    layout (e.g. another device) is started afresh.
+
+    open() and close() touch the disk, and should be run in an executor.
+    """
+
+    def __init__(self, path: Path | str, capacity: int, slots: int) -> None:
+        self.path = Path(path)
+        self.capacity = capacity
+        self.slots = slots
+        self.count = 0
+        self._head = 0
+        self._record = struct.Struct(f"<dHH{slots}H")
+        self._padding = (0,) * slots
+        self._map: mmap.mmap | None = None
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def is_open(self) -> bool:
+        return self._map is not None
+
+    @property
+    def size(self) -> int:
+        """The size of the file in bytes"""
+        return HEADER_SIZE + self.capacity * self._record.size
+
+    def open(self) -> None:
+        """Map the file, creating it or starting it afresh if needed"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size != self.size:
+                os.ftruncate(fd, self.size)
+            mapped = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        magic, version, slots, capacity, head, count = _HEADER.unpack_from(mapped, 0)
+        if (magic, version, slots, capacity) == (MAGIC, VERSION, self.slots, self.capacity) and head < capacity and count <= capacity:
+            self._head, self.count = head, count
+        else:
+            _LOGGER.debug('history.py:RegisterHistory.open: starting %s afresh', self.path)
+            self._head, self.count = 0, 0
+            _HEADER.pack_into(mapped, 0, MAGIC, VERSION, self.slots, self.capacity, self._head, self.count)
+        # Only now, as appends are ignored until the file is mapped
+        self._map = mapped
+        _LOGGER.debug('history.py:RegisterHistory.open: %s holds %s records', self.path, self.count)
+
+    def close(self) -> None:
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+
+    def _write_header(self) -> None:
+        _HEADER.pack_into(self._map, 0, MAGIC, VERSION, self.slots, self.capacity, self._head, self.count)
+
+    def append(self, timestamp: float, start: int, values: list[int]) -> None:
+        """Add a block, overwriting the oldest once full; ignored while closed"""
+        if self._map is None:
+            return
+        if len(values) > self.slots:
+            raise ValueError(f"Block of {len(values)} registers does not fit a record of {self.slots}")
+        offset = HEADER_SIZE + self._head * self._record.size
+        self._record.pack_into(self._map, offset, timestamp, start, len(values), *values, *self._padding[len(values):])
+        self._head = (self._head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self._write_header()
+
+    def _read(self, index: int) -> HistoryRecord:
+        """The record ``index`` places from the oldest held"""
+        slot = (self._head - self.count + index) % self.capacity
+        timestamp, start, count, *values = self._record.unpack_from(self._map, HEADER_SIZE + slot * self._record.size)
+        return HistoryRecord(timestamp, start, tuple(values[:count]))
+
+    def records(self) -> Iterator[HistoryRecord]:
+        """The records held, oldest first"""
+        if self._map is None:
+            return
+        for index in range(self.count):
+            yield self._read(index)
+
+    def latest(self, count: int) -> list[HistoryRecord]:
+        """The ``count`` most recent records, oldest first"""
+        if self._map is None:
+            return []
+        return [self._read(index) for index in range(max(0, self.count - count), self.count)]
+
+    def last_values(self) -> dict[int, tuple[int, float]]:
+        """The most recent value of every register held, and when it was read"""
+        registers = {}
+        for record in self.records():
+            for register, value in enumerate(record.values, record.start):
+                registers[register] = (value, record.timestamp)
+        return registers
+
+    def span(self) -> tuple[float, float] | None:
+        """The times of the oldest and newest records; None if there are none"""
+        if self._map is None or not self.count:
+            return None
+        oldest = (self._head - self.count) % self.capacity
+        newest = (self._head - 1) % self.capacity
+        return (
+            struct.unpack_from("<d", self._map, HEADER_SIZE + oldest * self._record.size)[0],
+            struct.unpack_from("<d", self._map, HEADER_SIZE + newest * self._record.size)[0],
+        )
@@ -0,0 +1,137 @@
+"""Plan the Modbus reads needed to fetch a set of sensors."""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from itertools import combinations
+
+from .const import PollTier, SensorDefinition
+
+
+def register_count(definition: SensorDefinition) -> int:
+    """Number of 16-bit registers occupied by a sensor (mb_size is in bytes)"""
+    return max(1, (definition.mb_size + 1) // 2)
+
+
+@dataclass
+class RegisterBlock:
+    """A contiguous range of registers fetched with a single Modbus read
+
+    :param start: The first register in the block
+    :param count: The number of registers in the block
+    :param definitions: The sensors whose registers fall in this block
+    """
+    start: int
+    count: int
+    definitions: list[SensorDefinition] = field(default_factory=list)
+
+    @property
+    def end(self) -> int:
+        """The register after the last one in the block"""
+        return self.start + self.count
+
+    def __str__(self) -> str:
+        return f"0x{self.start:04X}-0x{self.end - 1:04X} ({self.count} registers, {len(self.definitions)} sensors)"
+
+
+def plan_register_blocks(
+    definitions: list[SensorDefinition],
+    max_block_size: int,
+    gap_tolerance: int,
+) -> list[RegisterBlock]:
+    """Group sensor registers into as few Modbus reads as possible.
+
+    Sensors are taken in register order and added to the current block as long
+    as the block stays within ``max_block_size`` registers and the gap of
+    unused registers in front of the sensor is at most ``gap_tolerance``;
+    otherwise a new block is started. Reading a few unused registers is much
+    cheaper than another round trip to the logger, but very sparse maps are
+    better served by separate reads.
+    """
+    blocks: list[RegisterBlock] = []
+    for definition in sorted(definitions, key=lambda d: d.mb_offset):
+        start = definition.mb_offset
+        end = start + register_count(definition)
+        if end - start > max_block_size:
+            raise ValueError(
+                f"Sensor {definition.name} spans {end - start} registers, more than the maximum block size of {max_block_size}"
+            )
+        block = blocks[-1] if blocks else None
+        if (
+            block is not None
+            and start - block.end <= gap_tolerance
+            and max(end, block.end) - block.start <= max_block_size
+        ):
+            block.count = max(end, block.end) - block.start
+            block.definitions.append(definition)
+        else:
+            blocks.append(RegisterBlock(start=start, count=end - start, definitions=[definition]))
+    return blocks
+
+
+def tier_registers(block: RegisterBlock) -> dict[PollTier, list[int]]:
+    """The registers of a block's sensors, by the poll tier of the sensor
+
+    A register shared by sensors of several tiers is listed under each.
+    """
+    registers = {}
+    for definition in block.definitions:
+        offsets = registers.setdefault(definition.poll_tier, [])
+        offsets.extend(range(definition.mb_offset, definition.mb_offset + register_count(definition)))
+    return registers
+
+
+class PollPlan:
+    """The reads of every combination of due poll tiers
+
+    The sensors of all the tiers due on a tick are planned together, so a
+    block of fast sensors next to a block of slow ones is read in one round
+    trip when both are due, rather than one per tier. There are only a few
+    combinations (with the default tiers, fast alone, fast and medium, or all
+    three), so each is planned on first use and kept.
+    """
+
+    def __init__(self, definitions: list[SensorDefinition], max_block_size: int, gap_tolerance: int) -> None:
+        self.max_block_size = max_block_size
+        self.gap_tolerance = gap_tolerance
+        self.definitions: dict[PollTier, list[SensorDefinition]] = {}
+        for definition in definitions:
+            self.definitions.setdefault(definition.poll_tier, []).append(definition)
+        self._blocks: dict[frozenset, list[RegisterBlock]] = {}
+
+    @property
+    def tiers(self) -> list[PollTier]:
+        return list(self.definitions)
+
+    def blocks(self, tiers) -> list[RegisterBlock]:
+        """The reads of the sensors of ``tiers``"""
+        key = frozenset(tiers)
+        blocks = self._blocks.get(key)
+        if blocks is None:
+            definitions = [definition for tier in key for definition in self.definitions.get(tier, ())]
+            blocks = self._blocks[key] = plan_register_blocks(definitions, self.max_block_size, self.gap_tolerance)
+        return blocks
+
+    def largest_block(self) -> int:
+        """The most registers a single read takes, whichever tiers are due"""
+        return max(
+            (
+                block.count
+                for size in range(1, len(self.definitions) + 1)
+                for tiers in combinations(self.definitions, size)
+                for block in self.blocks(tiers)
+            ),
+            default=1,
+        )
+
+    def planned(self) -> dict[frozenset, list[RegisterBlock]]:
+        """The combinations of tiers planned so far, and their reads"""
+        return dict(self._blocks)
+
+
+def describe_plan(blocks: list[RegisterBlock]) -> str:
+    """A human-readable summary of a plan, for logging and diagnostics"""
+    registers = sum(block.count for block in blocks)
+    sensors = sum(len(block.definitions) for block in blocks)
+    lines = [f"{len(blocks)} reads, {registers} registers, {sensors} sensors"]
+    lines.extend(f"  {block}" for block in blocks)
+    return "\n".join(lines)
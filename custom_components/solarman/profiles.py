@@ -0,0 +1,263 @@
+"""Device profiles: the sensors of each supported device, declared in YAML.
+
+Every ``profiles/*.yaml`` file describes one device: the sensors read from its
+registers, and optionally sensors derived from those. The files are validated
+and compiled into SensorDefinitions and DerivedDefinitions once, when the
+integration is imported.
+The compiled profiles are cached in Home Assistant's ``.storage`` directory,
+keyed by a hash of the files and of the code that compiles them, so later
+starts skip parsing and validation unless either was changed.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import pickle
+from dataclasses import dataclass
+from enum import Enum
+from pathlib import Path
+from typing import Final
+
+import voluptuous as vol
+import yaml
+
+from homeassistant.components.sensor import SensorDeviceClass, SensorStateClass
+from homeassistant.helpers.storage import STORAGE_DIR
+
+from .const import DOMAIN, MODBUS_MAX_REGISTERS, DerivedDefinition, PollTier, SensorDefinition
+from .decoder import WORD_ORDER_BIG, WORD_ORDER_LITTLE
+from .derived import DERIVED_KINDS
+
+_LOGGER = logging.getLogger(__name__)
+
+PROFILES_DIR: Final = Path(__file__).parent / "profiles"
+# The integration is installed in <config>/custom_components/solarman; outside
+# a Home Assistant configuration there is no .storage, and nothing is cached
+CACHE_FILE: Final = Path(__file__).parents[2] / STORAGE_DIR / f"{DOMAIN}.profiles.pickle"
+# The modules defining and validating the compiled form, so that changing any
+# of them invalidates existing caches
+COMPILER_MODULES: Final = ("profiles.py", "const.py", "decoder.py", "derived.py")
+
+# Register type: (size in bytes, signed)
+REGISTER_TYPES: Final = {
+    "u16": (2, False),
+    "s16": (2, True),
+    "u32": (4, False),
+    "s32": (4, True),
+}
+
+SENSOR_SCHEMA = vol.Schema(
+    {
+        vol.Required("name"): str,
+        vol.Required("register"): vol.All(int, vol.Range(min=0, max=0xFFFF)),
+        vol.Optional("type", default="u16"): vol.In(REGISTER_TYPES),
+        vol.Optional("scale", default=1): vol.Any(int, float),
+        vol.Optional("word_order", default=WORD_ORDER_BIG): vol.In([WORD_ORDER_BIG, WORD_ORDER_LITTLE]),
+        vol.Optional("bitmask"): vol.All(int, vol.Range(min=0)),
+        vol.Optional("bitshift"): vol.All(int, vol.Range(min=0, max=31)),
+        vol.Optional("unit"): str,
+        vol.Optional("device_class"): vol.Coerce(SensorDeviceClass),
+        vol.Optional("state_class", default=SensorStateClass.MEASUREMENT.value): vol.Coerce(SensorStateClass),
+        vol.Optional("poll_tier", default="fast"): vol.In([tier.name.lower() for tier in PollTier]),
+        vol.Optional("deadband_abs", default=0): vol.All(vol.Any(int, float), vol.Range(min=0)),
+        vol.Optional("deadband_rel", default=0): vol.All(vol.Any(int, float), vol.Range(min=0)),
+        vol.Optional("max_silence"): vol.All(int, vol.Range(min=1)),
+        vol.Optional("max_rate"): vol.All(vol.Any(int, float), vol.Range(min=0)),
+        vol.Optional("daily_reset", default=False): bool,
+    }
+)
+
+DERIVED_SCHEMA = vol.Schema(
+    {
+        vol.Required("name"): str,
+        vol.Required("kind"): vol.In(DERIVED_KINDS),
+        vol.Required("inputs"): vol.All([str], vol.Length(min=1)),
+        vol.Optional("scale", default=1): vol.Any(int, float),
+        vol.Optional("precision"): vol.All(int, vol.Range(min=0, max=10)),
+        vol.Optional("max_gap", default=600): vol.All(int, vol.Range(min=1)),
+        vol.Optional("unit"): str,
+        vol.Optional("device_class"): vol.Coerce(SensorDeviceClass),
+        vol.Optional("state_class", default=SensorStateClass.MEASUREMENT.value): vol.Coerce(SensorStateClass),
+        vol.Optional("deadband_abs", default=0): vol.All(vol.Any(int, float), vol.Range(min=0)),
+        vol.Optional("deadband_rel", default=0): vol.All(vol.Any(int, float), vol.Range(min=0)),
+        vol.Optional("max_silence"): vol.All(int, vol.Range(min=1)),
+    }
+)
+
+PROFILE_SCHEMA = vol.Schema(
+    {
+        vol.Required("device"): vol.Match(r"^[A-Z][A-Z0-9_]*$"),
+        vol.Required("model"): str,
+        vol.Optional("max_block_size", default=MODBUS_MAX_REGISTERS): vol.All(int, vol.Range(min=1, max=MODBUS_MAX_REGISTERS)),
+        vol.Required("sensors"): vol.All([SENSOR_SCHEMA], vol.Length(min=1)),
+        vol.Optional("derived", default=[]): [DERIVED_SCHEMA],
+    }
+)
+
+
+@dataclass(frozen=True)
+class DeviceProfile:
+    """A validated, compiled device profile
+
+    :param device: The key of the device, as stored in config entries, e.g. 'LSW3'
+    :param model: The model shown in the device registry, e.g. 'LSW-3'
+    :param max_block_size: The most registers the device returns in a single read
+    :param sensors: The sensors of the device
+    :param derived: The sensors computed from those, in the order they are computed
+    """
+    device: str
+    model: str
+    max_block_size: int
+    sensors: tuple[SensorDefinition, ...]
+    derived: tuple[DerivedDefinition, ...] = ()
+
+
+def _compile_sensor(sensor: dict) -> SensorDefinition:
+    size, signed = REGISTER_TYPES[sensor["type"]]
+    if sensor["register"] + size // 2 > 0x10000:
+        raise vol.Invalid(f"Sensor {sensor['name']} runs past the last register")
+    return SensorDefinition(
+        name=sensor["name"],
+        device_class=sensor.get("device_class"),
+        state_class=sensor["state_class"],
+        unit=sensor.get("unit"),
+        mb_offset=sensor["register"],
+        mb_size=size,
+        mb_mult=sensor["scale"],
+        mb_signed=signed,
+        mb_word_order=sensor["word_order"],
+        mb_bitmask=sensor.get("bitmask"),
+        mb_bitshift=sensor.get("bitshift"),
+        poll_tier=PollTier[sensor["poll_tier"].upper()],
+        deadband_abs=sensor["deadband_abs"],
+        deadband_rel=sensor["deadband_rel"],
+        max_silence=sensor.get("max_silence"),
+        max_rate=sensor.get("max_rate"),
+        daily_reset=sensor["daily_reset"],
+    )
+
+
+def _compile_derived(derived: dict, known: set[str]) -> DerivedDefinition:
+    """Compile a derived sensor, whose inputs must be among the ``known`` names"""
+    fewest, most = DERIVED_KINDS[derived["kind"]]
+    inputs = derived["inputs"]
+    if len(inputs) < fewest or (most is not None and len(inputs) > most):
+        raise vol.Invalid(f"Derived sensor {derived['name']} has {len(inputs)} inputs, which a {derived['kind']} cannot take")
+    unknown = [name for name in inputs if name not in known]
+    if unknown:
+        raise vol.Invalid(f"Derived sensor {derived['name']} uses unknown sensors: {', '.join(unknown)}")
+    return DerivedDefinition(
+        name=derived["name"],
+        device_class=derived.get("device_class"),
+        state_class=derived["state_class"],
+        unit=derived.get("unit"),
+        kind=derived["kind"],
+        inputs=tuple(inputs),
+        scale=derived["scale"],
+        precision=derived.get("precision"),
+        max_gap=derived["max_gap"],
+        deadband_abs=derived["deadband_abs"],
+        deadband_rel=derived["deadband_rel"],
+        max_silence=derived.get("max_silence"),
+    )
+
+
+def compile_profile(source: str) -> DeviceProfile:
+    """Parse, validate and compile a single profile; raises vol.Invalid or yaml.YAMLError"""
+    profile = PROFILE_SCHEMA(yaml.load(source, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader)))
+    names = [sensor["name"] for sensor in profile["sensors"] + profile["derived"]]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise vol.Invalid(f"Duplicate sensor names: {', '.join(duplicates)}")
+    # Derived sensors may only use sensors, or derived sensors declared before them
+    known = {sensor["name"] for sensor in profile["sensors"]}
+    derived = []
+    for item in profile["derived"]:
+        derived.append(_compile_derived(item, known))
+        known.add(item["name"])
+    return DeviceProfile(
+        device=profile["device"],
+        model=profile["model"],
+        max_block_size=profile["max_block_size"],
+        sensors=tuple(_compile_sensor(sensor) for sensor in profile["sensors"]),
+        derived=tuple(derived),
+    )
+
+
+def _compile_profiles(sources: dict[str, bytes]) -> dict[str, DeviceProfile]:
+    """Compile all profiles, skipping (and logging) any that are invalid"""
+    profiles: dict[str, DeviceProfile] = {}
+    models = set()
+    for filename, source in sources.items():
+        try:
+            profile = compile_profile(source.decode("utf-8"))
+        except (vol.Invalid, yaml.YAMLError, UnicodeDecodeError) as err:
+            _LOGGER.error('profiles.py:_compile_profiles: ignoring invalid profile %s: %s', filename, err)
+            continue
+        if profile.device in profiles or profile.model in models:
+            _LOGGER.error('profiles.py:_compile_profiles: ignoring profile %s: device %s or model %s is already defined', filename, profile.device, profile.model)
+            continue
+        profiles[profile.device] = profile
+        models.add(profile.model)
+    return profiles
+
+
+def _cache_key(sources: dict[str, bytes]) -> str:
+    digest = hashlib.sha256()
+    package = Path(__file__).parent
+    compiler = {module: (package / module).read_bytes() for module in COMPILER_MODULES}
+    for filename, source in (*compiler.items(), *sources.items()):
+        digest.update(filename.encode())
+        digest.update(len(source).to_bytes(8, "little"))
+        digest.update(source)
+    return digest.hexdigest()
+
+
+def load_profiles(directory: Path = PROFILES_DIR, cache_file: Path | None = CACHE_FILE) -> dict[str, DeviceProfile]:
+    """Load every profile in ``directory``, from the cache unless a profile, or
+    the code compiling them, has changed"""
+    sources = {path.name: path.read_bytes() for path in sorted(directory.glob("*.yaml"))}
+    key = _cache_key(sources)
+
+    if cache_file is not None:
+        try:
+            with cache_file.open("rb") as file:
+                cached_key, profiles = pickle.load(file)
+            if cached_key == key:
+                return profiles
+        except FileNotFoundError:
+            pass
+        except Exception as err:  # a stale or corrupt cache is simply rebuilt
+            _LOGGER.debug('profiles.py:load_profiles: discarding profile cache: %s', err)
+
+    profiles = _compile_profiles(sources)
+    _LOGGER.debug('profiles.py:load_profiles: compiled %d profiles from %s', len(profiles), directory)
+
+    if cache_file is not None and cache_file.parent.is_dir():
+        try:
+            temp_file = cache_file.with_suffix(".tmp")
+            with temp_file.open("wb") as file:
+                pickle.dump((key, profiles), file, protocol=pickle.HIGHEST_PROTOCOL)
+            temp_file.replace(cache_file)
+        except OSError as err:
+            _LOGGER.debug('profiles.py:load_profiles: could not write profile cache: %s', err)
+    return profiles
+
+
+PROFILES: Final = load_profiles()
+
+# Config entries store the device by name, e.g. Device['LSW3']; the value is the model
+Device = Enum("Device", {key: profile.model for key, profile in PROFILES.items()})
+
+SENSOR_DEFINITIONS: Final = {
+    Device[key]: list(profile.sensors) for key, profile in PROFILES.items()
+}
+
+DERIVED_DEFINITIONS: Final = {
+    Device[key]: list(profile.derived) for key, profile in PROFILES.items()
+}
+
+# The most registers each device will return in a single read
+DEVICE_MAX_BLOCK_SIZE: Final = {
+    Device[key]: profile.max_block_size for key, profile in PROFILES.items()
+}
@@ -1,13 +1,206 @@
 #!/usr/bin/env python3
 """pysolarmanv5.py"""
+import bisect
+import collections
+import heapq
+import itertools
 import struct
 import socket
+import time
 
 from umodbus.client.serial import rtu
+from umodbus.client.serial.redundancy_check import CRCError
+from umodbus.exceptions import ModbusError
 
 
 class V5FrameError(Exception):
-    pass
+    """A V5 frame failed validation
+
+    reason names the check that failed, e.g. "checksum" or "serial", so that
+    errors can be counted by type.
+    """
+
+    def __init__(self, message, reason="invalid"):
+        super().__init__(message)
+        self.reason = reason
+
+
+class V5Metrics:
+    """Counters and timings of the traffic with a data logger
+
+    Cheap enough to be updated on every request. One instance can be shared
+    by the successive clients of a logger, so that the figures survive
+    reconnects. Times are in seconds.
+    """
+
+    # Upper bounds of the round trip time histogram buckets; the last bucket
+    # counts everything slower
+    RTT_BUCKETS = (0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+
+    def __init__(self):
+        self.connects = 0
+        self.connect_time = None
+        self.requests = 0
+        self.responses = 0
+        self.timeouts = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.spurious_frames = 0
+        self.frame_errors = {}
+        self.rtt_last = None
+        self.rtt_max = 0.0
+        self.rtt_total = 0.0
+        self.rtt_histogram = [0] * (len(self.RTT_BUCKETS) + 1)
+
+    @property
+    def rtt_average(self):
+        """Mean round trip time over all responses, None before the first"""
+        return self.rtt_total / self.responses if self.responses else None
+
+    @property
+    def frame_error_count(self):
+        return sum(self.frame_errors.values())
+
+    def record_connect(self, duration):
+        self.connects += 1
+        self.connect_time = duration
+
+    def record_request(self, size):
+        self.requests += 1
+        self.bytes_sent += size
+
+    def record_rtt(self, rtt):
+        self.responses += 1
+        self.rtt_last = rtt
+        self.rtt_total += rtt
+        if rtt > self.rtt_max:
+            self.rtt_max = rtt
+        self.rtt_histogram[bisect.bisect_left(self.RTT_BUCKETS, rtt)] += 1
+
+    def record_frame_error(self, reason):
+        self.frame_errors[reason] = self.frame_errors.get(reason, 0) + 1
+
+    def as_dict(self):
+        """All figures, e.g. for a diagnostics dump"""
+        bounds = [f"<={bound}" for bound in self.RTT_BUCKETS] + [f">{self.RTT_BUCKETS[-1]}"]
+        return {
+            "connects": self.connects,
+            "connect_time": self.connect_time,
+            "requests": self.requests,
+            "responses": self.responses,
+            "timeouts": self.timeouts,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": self.bytes_received,
+            "spurious_frames": self.spurious_frames,
+            "frame_errors": dict(self.frame_errors),
+            "rtt_last": self.rtt_last,
+            "rtt_average": self.rtt_average,
+            "rtt_max": self.rtt_max,
+            "rtt_histogram": dict(zip(bounds, self.rtt_histogram)),
+        }
+
+
+class V5FrameBuffer:
+    """Reassembles V5 frames from a stream of bytes
+
+    Bytes received from the data logger are fed in as they arrive, and
+    complete frames are taken out one at a time using the length field in the
+    V5 header (start + length + controlcode + serial + loggerserial = 11 bytes,
+    followed by <length> bytes of payload, checksum and end). This copes with
+    frames split across several reads as well as several frames coalesced
+    into one read. Bytes that cannot be the start of a frame are discarded.
+    """
+
+    START = 0xA5
+    END = 0x15
+    HEADER_LEN = 11
+    TRAILER_LEN = 2
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def feed(self, data):
+        """Append received bytes to the buffer"""
+        self._buffer += data
+
+    def clear(self):
+        """Discard everything buffered so far"""
+        self._buffer.clear()
+
+    def next_frame(self):
+        """Return the next complete frame, or None if more data is needed"""
+        buffer = self._buffer
+        while buffer:
+            start = buffer.find(self.START)
+            if start < 0:
+                buffer.clear()
+                return None
+            if start:
+                del buffer[:start]
+            if len(buffer) < 3:
+                return None
+            frame_len = (
+                self.HEADER_LEN
+                + int.from_bytes(buffer[1:3], byteorder="little")
+                + self.TRAILER_LEN
+            )
+            if len(buffer) < frame_len:
+                return None
+            if buffer[frame_len - 1] != self.END:
+                # Not a frame after all; resynchronise on the next start byte
+                del buffer[0]
+                continue
+            frame = bytes(buffer[:frame_len])
+            del buffer[:frame_len]
+            return frame
+        return None
+
+
+class V5FrameTrace:
+    """The last few frames sent to and received from a data logger
+
+    Bounded ring buffers for troubleshooting, one per direction, each keeping
+    the last ``size`` frames: once full, each new frame pushes out the oldest
+    of its direction, so a burst of requests never pushes out the replies.
+    Frames are kept as raw bytes and only formatted by dump(), so recording
+    one costs no more than an append.
+    """
+
+    SENT = "SENT"
+    RECD = "RECD"
+
+    def __init__(self, size):
+        self.size = size
+        self._frames = {
+            self.SENT: collections.deque(maxlen=size),
+            self.RECD: collections.deque(maxlen=size),
+        }
+        # Orders frames recorded within the same clock tick
+        self._sequence = itertools.count()
+
+    def __len__(self):
+        return sum(len(frames) for frames in self._frames.values())
+
+    def record(self, direction, frame):
+        self._frames[direction].append((next(self._sequence), time.time(), bytes(frame)))
+
+    def clear(self):
+        for frames in self._frames.values():
+            frames.clear()
+
+    def dump(self):
+        """The frames of both directions, oldest first, as lines of timestamp, direction and hex"""
+        merged = heapq.merge(*(
+            [(sequence, at, direction, frame) for sequence, at, frame in frames]
+            for direction, frames in self._frames.items()
+        ))
+        return [
+            f"{time.strftime('%H:%M:%S', time.localtime(at))}.{int(at % 1 * 1000):03d} {direction} {frame.hex(' ')}"
+            for _, at, direction, frame in merged
+        ]
 
 
 class PySolarmanV5:
@@ -26,7 +219,9 @@ class PySolarmanV5:
     def __init__(self, address, serial, **kwargs):
         """Constructor. Requires address and serial number of data logger as
         required parameters. Optional parameters are port, modbus slave id,
-        socket timeout, and log verbosity
+        socket timeout, log verbosity, a V5Metrics instance to record into and
+        a V5FrameTrace to record raw frames into (None, the default, disables
+        tracing)
         """
 
         self.address = address
@@ -36,8 +231,11 @@ class PySolarmanV5:
         self.mb_slave_id = kwargs.get("mb_slave_id", 1)
         self.verbose = kwargs.get("verbose", 0)
         self.socket_timeout = kwargs.get("socket_timeout", 60)
+        self.metrics = kwargs.get("metrics") or V5Metrics()
+        self.frame_trace = kwargs.get("frame_trace")
 
         self._v5_frame_def()
+        self._rx_buffer = V5FrameBuffer()
         self.sock = self._create_socket()
 
     def _v5_frame_def(self):
@@ -57,6 +255,7 @@ class PySolarmanV5:
         self.v5_start = bytes.fromhex("A5")
         self.v5_length = bytes.fromhex("1700")
         self.v5_controlcode = bytes.fromhex("1045")
+        self.v5_controlcode_response = bytes.fromhex("1015")
         self.v5_serial = bytes.fromhex("0000")
         self.v5_loggerserial = struct.unpack(">I", struct.pack("<I", int(self.serial)))[
             0
@@ -65,28 +264,43 @@ class PySolarmanV5:
         self.v5_checksum = bytes.fromhex("00")
         self.v5_end = bytes.fromhex("15")  # Logger End code
 
-    @staticmethod
-    def _calculate_v5_frame_checksum(frame):
-        """Calculate checksum on all frame bytes except head, end and checksum"""
-        checksum = 0
-        for i in range(1, len(frame) - 2, 1):
-            checksum += frame[i] & 0xFF
-        return int((checksum & 0xFF))
-
-    def _v5_frame_encoder(self, modbus_frame):
-        """Take a modbus RTU frame and encode it in a V5 data logging stick frame"""
-        v5_frame = bytearray(
+        # Everything up to the modbus frame is the same for every request from
+        # this client, apart from the length and sequence number. Build it
+        # once, along with its contribution to the checksum (which excludes
+        # start, length and sequence number).
+        self._v5_header = (
             self.v5_start
             + self.v5_length
             + self.v5_controlcode
             + self.v5_serial
             + self.v5_loggerserial
             + self.v5_datafield
-            + modbus_frame
-            + self.v5_checksum
-            + self.v5_end
         )
-        v5_frame[len(v5_frame) - 2] = self._calculate_v5_frame_checksum(v5_frame)
+        self._v5_header_checksum = sum(self._v5_header[3:]) - self._v5_header[5]
+        self._v5_trailer = self.v5_checksum + self.v5_end
+        self._v5_start_byte = self.v5_start[0]
+        self._v5_end_byte = self.v5_end[0]
+
+    @staticmethod
+    def _calculate_v5_frame_checksum(frame):
+        """Calculate checksum on all frame bytes except head, end and checksum"""
+        return sum(memoryview(frame)[1:-2]) & 0xFF
+
+    def _v5_frame_encoder(self, modbus_frame, sequence=0):
+        """Take a modbus RTU frame and encode it in a V5 data logging stick frame
+
+        The header comes from the prebuilt template; only the length, the
+        sequence number (first byte of the serial field, echoed back by the
+        logger in its reply) and the checksum are filled in. The checksum is
+        the template's precomputed share plus the bytes filled in.
+        """
+        length = (len(self.v5_datafield) + len(modbus_frame)).to_bytes(2, byteorder="little")
+        v5_frame = bytearray(self._v5_header)
+        v5_frame += modbus_frame
+        v5_frame += self._v5_trailer
+        v5_frame[1:3] = length
+        v5_frame[5] = sequence
+        v5_frame[-2] = (self._v5_header_checksum + sum(length) + sequence + sum(modbus_frame)) & 0xFF
         return v5_frame
 
     def _v5_frame_decoder(self, v5_frame):
@@ -109,54 +323,105 @@ class PySolarmanV5:
         """
         frame_len = len(v5_frame)
 
-        if (v5_frame[0] != int.from_bytes(self.v5_start, byteorder="big")) or (
-            v5_frame[frame_len - 1] != int.from_bytes(self.v5_end, byteorder="big")
+        if (v5_frame[0] != self._v5_start_byte) or (
+            v5_frame[frame_len - 1] != self._v5_end_byte
         ):
-            raise V5FrameError("V5 frame contains invalid header or trailer values")
+            raise V5FrameError("V5 frame contains invalid header or trailer values", "header")
         if v5_frame[frame_len - 2] != self._calculate_v5_frame_checksum(v5_frame):
-            raise V5FrameError("V5 frame contains invalid V5 checksum")
+            raise V5FrameError("V5 frame contains invalid V5 checksum", "checksum")
         if v5_frame[7:11] != self.v5_loggerserial:
-            raise V5FrameError("V5 frame contains incorrect data logger serial number")
-        if v5_frame[3:5] != bytes.fromhex("1015"):
-            raise V5FrameError("V5 frame contains incorrect control code")
-        if v5_frame[11] != int("02", 16):
-            raise V5FrameError("V5 frame contains invalid datafield prefix")
+            raise V5FrameError("V5 frame contains incorrect data logger serial number", "serial")
+        if v5_frame[3:5] != self.v5_controlcode_response:
+            raise V5FrameError("V5 frame contains incorrect control code", "control_code")
+        if v5_frame[11] != 0x02:
+            raise V5FrameError("V5 frame contains invalid datafield prefix", "datafield")
 
-        modbus_frame = v5_frame[25 : frame_len - 2]
+        modbus_frame = memoryview(v5_frame)[25 : frame_len - 2]
 
         if len(modbus_frame) < 5:
-            raise V5FrameError("V5 frame does not contain a valid Modbus RTU frame")
+            raise V5FrameError("V5 frame does not contain a valid Modbus RTU frame", "modbus_frame")
 
         return modbus_frame
 
+    def _is_response_frame(self, v5_frame):
+        """True if v5_frame is a reply to a request, rather than a heartbeat or
+        other spurious frame sent unprompted by the data logger"""
+        return v5_frame[3:5] == self.v5_controlcode_response
+
     def _send_receive_v5_frame(self, data_logging_stick_frame):
-        """Send v5 frame to the data logger and receive response"""
+        """Send v5 frame to the data logger and receive response
+
+        Reads until one complete response frame has been assembled, skipping
+        any spurious frames (e.g. 0x1047 control codes) in between.
+        """
         if self.verbose == 1:
             print("SENT: " + data_logging_stick_frame.hex(" "))
+        if self.frame_trace is not None:
+            self.frame_trace.record(V5FrameTrace.SENT, data_logging_stick_frame)
 
+        self._rx_buffer.clear()
         self.sock.sendall(data_logging_stick_frame)
-        v5_response = self.sock.recv(1024)
-
-        if self.verbose == 1:
-            print("RECD: " + v5_response.hex(" "))
-        return v5_response
+        self.metrics.record_request(len(data_logging_stick_frame))
+        sent = time.monotonic()
+        while True:
+            v5_response = self._rx_buffer.next_frame()
+            if v5_response is None:
+                try:
+                    data = self.sock.recv(1024)
+                except socket.timeout:
+                    self.metrics.timeouts += 1
+                    raise
+                if not data:
+                    raise ConnectionResetError("Data logger closed the connection")
+                self.metrics.bytes_received += len(data)
+                self._rx_buffer.feed(data)
+                continue
+            if self.verbose == 1:
+                print("RECD: " + v5_response.hex(" "))
+            if self.frame_trace is not None:
+                self.frame_trace.record(V5FrameTrace.RECD, v5_response)
+            if self._is_response_frame(v5_response):
+                self.metrics.record_rtt(time.monotonic() - sent)
+                return v5_response
+            self.metrics.spurious_frames += 1
+
+    def _decode_response(self, v5_response_frame):
+        """_v5_frame_decoder(), counting the frames that fail validation"""
+        try:
+            return self._v5_frame_decoder(v5_response_frame)
+        except V5FrameError as err:
+            self.metrics.record_frame_error(err.reason)
+            raise
+
+    def _parse_modbus_response(self, mb_response_frame, mb_request_frame):
+        """rtu.parse_response_adu(), counting bad CRCs and Modbus exceptions"""
+        try:
+            return rtu.parse_response_adu(mb_response_frame, mb_request_frame)
+        except CRCError:
+            self.metrics.record_frame_error("modbus_crc")
+            raise
+        except ModbusError:
+            self.metrics.record_frame_error("modbus_exception")
+            raise
 
     def _send_receive_modbus_frame(self, mb_request_frame):
         """Encodes mb_frame, sends/receives v5_frame, decodes response"""
         v5_request_frame = self._v5_frame_encoder(mb_request_frame)
         v5_response_frame = self._send_receive_v5_frame(v5_request_frame)
-        mb_response_frame = self._v5_frame_decoder(v5_response_frame)
+        mb_response_frame = self._decode_response(v5_response_frame)
         return mb_response_frame
 
     def _get_modbus_response(self, mb_request_frame):
         """Returns mb response values for a given mb_request_frame"""
         mb_response_frame = self._send_receive_modbus_frame(mb_request_frame)
-        modbus_values = rtu.parse_response_adu(mb_response_frame, mb_request_frame)
+        modbus_values = self._parse_modbus_response(mb_response_frame, mb_request_frame)
         return modbus_values
 
     def _create_socket(self):
         """Creates and returns a socket"""
+        started = time.monotonic()
         sock = socket.create_connection((self.address, self.port), self.socket_timeout)
+        self.metrics.record_connect(time.monotonic() - started)
         return sock
 
     @staticmethod
@@ -264,7 +529,7 @@ class PySolarmanV5:
 
         Wrapper for internal method _send_receive_modbus_frame()
         """
-        return self._send_receive_modbus_frame(mb_request_frame)
+        return bytes(self._send_receive_modbus_frame(mb_request_frame))
 
     def send_raw_modbus_frame_parsed(self, mb_request_frame):
         """Send raw modbus frame and return parsed modbusresponse list
@@ -0,0 +1,320 @@
+"""pysolarmanv5_async.py"""
+import asyncio
+import random
+import time
+
+from umodbus.client.serial import rtu
+
+from .pysolarmanv5 import PySolarmanV5, V5FrameTrace
+
+
+class AsyncPySolarmanV5(PySolarmanV5):
+    """
+    pysolarmanv5_async.py
+
+    asyncio flavour of PySolarmanV5. Frame encoding and decoding is shared with
+    the blocking client; only the transport differs. The connection is opened
+    with asyncio.open_connection() so that no socket I/O ever blocks the event
+    loop, and all Modbus methods are coroutines.
+
+    The constructor does not connect, call (and await) connect() first, or use
+    the client as an async context manager.
+
+    Requests are tagged with a sequence number, which the logger echoes back in
+    its reply. By default requests are lock-step: one request is sent and its
+    reply awaited before the next is sent. With pipeline_window > 1, up to that
+    many requests may be in flight at once, and replies are matched to
+    requests by sequence number. Pipelining only starts once the logger has
+    been seen to echo sequence numbers; loggers that don't stay lock-step.
+    """
+
+    # Replies that must echo the sequence number before pipelining is trusted
+    SEQUENCE_CONFIRMATIONS = 2
+
+    def __init__(self, address, serial, **kwargs):
+        """Constructor. Takes the same parameters as PySolarmanV5, plus
+        pipeline_window (default 1, i.e. lock-step)
+        """
+        self.reader = None
+        self.writer = None
+        self.pipeline_window = kwargs.get("pipeline_window", 1)
+        self._lock = asyncio.Lock()
+        self._window = asyncio.Semaphore(self.pipeline_window)
+        self._sequence = random.randrange(0x100)
+        self._sequence_confirmations = 0
+        self._echoes_sequence = None
+        self._pending = {}
+        self._reader_task = None
+        super().__init__(address, serial, **kwargs)
+
+    def _create_socket(self):
+        """The asyncio transport is opened by connect(), not by the constructor"""
+        return None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    @property
+    def connected(self):
+        """True if the transport is open"""
+        return self.writer is not None and not self.writer.is_closing()
+
+    @property
+    def pipelined(self):
+        """True if requests are currently being pipelined"""
+        return self.pipeline_window > 1 and self._echoes_sequence is True
+
+    async def connect(self):
+        """Open the connection to the data logger"""
+        started = time.monotonic()
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.address, self.port), self.socket_timeout
+        )
+        self.metrics.record_connect(time.monotonic() - started)
+
+    async def disconnect(self):
+        """Close the connection to the data logger"""
+        writer = self.writer
+        self.reader = None
+        self.writer = None
+        self._rx_buffer.clear()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            self._reader_task = None
+        self._fail_pending(ConnectionResetError("Disconnected from data logger"))
+        if writer is None:
+            return
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+    def _next_sequence(self):
+        self._sequence = (self._sequence + 1) & 0xFF
+        return self._sequence
+
+    def _fail_pending(self, exc):
+        for future in self._pending.values():
+            if not future.done():
+                future.set_exception(exc)
+        self._pending.clear()
+
+    async def _receive_v5_frame(self):
+        """Read from the connection until a complete response frame is buffered"""
+        while True:
+            v5_response = self._rx_buffer.next_frame()
+            if v5_response is None:
+                if self.reader is None:
+                    raise ConnectionResetError("Disconnected from data logger")
+                data = await self.reader.read(1024)
+                if not data:
+                    raise ConnectionResetError("Data logger closed the connection")
+                self.metrics.bytes_received += len(data)
+                self._rx_buffer.feed(data)
+                continue
+            if self.verbose == 1:
+                print("RECD: " + v5_response.hex(" "))
+            if self.frame_trace is not None:
+                self.frame_trace.record(V5FrameTrace.RECD, v5_response)
+            if self._is_response_frame(v5_response):
+                return v5_response
+            self.metrics.spurious_frames += 1
+
+    async def _receive_reply(self, sequence):
+        """Receive the reply to the request with the given sequence number
+
+        While it is not yet known whether the logger echoes sequence numbers,
+        the first reply is taken; once it is known to, replies to earlier
+        requests (e.g. ones that timed out) are discarded.
+        """
+        while True:
+            v5_response = await self._receive_v5_frame()
+            if self._echoes_sequence is False:
+                return v5_response
+            if v5_response[5] == sequence:
+                if self._echoes_sequence is None:
+                    self._sequence_confirmations += 1
+                    if self._sequence_confirmations >= self.SEQUENCE_CONFIRMATIONS:
+                        self._echoes_sequence = True
+                return v5_response
+            if self._echoes_sequence is None:
+                self._echoes_sequence = False
+                return v5_response
+
+    async def _read_replies(self):
+        """Background task dispatching pipelined replies to their requests"""
+        try:
+            while True:
+                v5_response = await self._receive_v5_frame()
+                future = self._pending.get(v5_response[5])
+                if future is not None and not future.done():
+                    future.set_result(v5_response)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:  # pylint: disable=broad-except
+            self._reader_task = None
+            self._fail_pending(exc)
+
+    async def _send_receive_lockstep(self, data_logging_stick_frame, sequence):
+        # Checked again under the lock: a request that failed while this one
+        # waited for the lock may have disconnected
+        if not self.connected:
+            raise ConnectionError("Not connected to data logger")
+        self._rx_buffer.clear()
+        self.writer.write(data_logging_stick_frame)
+        self.metrics.record_request(len(data_logging_stick_frame))
+        sent = time.monotonic()
+        await self.writer.drain()
+        try:
+            v5_response = await asyncio.wait_for(
+                self._receive_reply(sequence), self.socket_timeout
+            )
+        except asyncio.TimeoutError:
+            self.metrics.timeouts += 1
+            raise
+        self.metrics.record_rtt(time.monotonic() - sent)
+        return v5_response
+
+    async def _send_receive_pipelined(self, data_logging_stick_frame, sequence):
+        async with self._window:
+            if not self.connected:
+                raise ConnectionError("Not connected to data logger")
+            future = asyncio.get_running_loop().create_future()
+            self._pending[sequence] = future
+            try:
+                if self._reader_task is None:
+                    self._reader_task = asyncio.create_task(self._read_replies())
+                self.writer.write(data_logging_stick_frame)
+                self.metrics.record_request(len(data_logging_stick_frame))
+                sent = time.monotonic()
+                await self.writer.drain()
+                try:
+                    v5_response = await asyncio.wait_for(future, self.socket_timeout)
+                except asyncio.TimeoutError:
+                    self.metrics.timeouts += 1
+                    raise
+                self.metrics.record_rtt(time.monotonic() - sent)
+                return v5_response
+            finally:
+                if self._pending.get(sequence) is future:
+                    del self._pending[sequence]
+
+    async def _send_receive_v5_frame(self, data_logging_stick_frame, sequence=0):
+        """Send v5 frame to the data logger and receive response
+
+        Spurious frames (e.g. 0x1047 control codes) are skipped; the timeout
+        applies to receiving the whole response frame.
+        """
+        if not self.connected:
+            raise ConnectionError("Not connected to data logger")
+
+        if self.verbose == 1:
+            print("SENT: " + data_logging_stick_frame.hex(" "))
+        if self.frame_trace is not None:
+            self.frame_trace.record(V5FrameTrace.SENT, data_logging_stick_frame)
+
+        async with self._lock:
+            if not self.pipelined:
+                return await self._send_receive_lockstep(data_logging_stick_frame, sequence)
+        return await self._send_receive_pipelined(data_logging_stick_frame, sequence)
+
+    async def _send_receive_modbus_frame(self, mb_request_frame):
+        """Encodes mb_frame, sends/receives v5_frame, decodes response"""
+        sequence = self._next_sequence()
+        v5_request_frame = self._v5_frame_encoder(mb_request_frame, sequence)
+        v5_response_frame = await self._send_receive_v5_frame(v5_request_frame, sequence)
+        mb_response_frame = self._decode_response(v5_response_frame)
+        return mb_response_frame
+
+    async def _get_modbus_response(self, mb_request_frame):
+        """Returns mb response values for a given mb_request_frame"""
+        mb_response_frame = await self._send_receive_modbus_frame(mb_request_frame)
+        modbus_values = self._parse_modbus_response(mb_response_frame, mb_request_frame)
+        return modbus_values
+
+    async def read_input_registers(self, register_addr, quantity):
+        """Read input registers from modbus slave and return list of register values (Modbus function code 4)"""
+        mb_request_frame = rtu.read_input_registers(
+            self.mb_slave_id, register_addr, quantity
+        )
+        modbus_values = await self._get_modbus_response(mb_request_frame)
+        return modbus_values
+
+    async def read_holding_registers(self, register_addr, quantity):
+        """Read holding registers from modbus slave and return list of register values (Modbus function code 3)"""
+        mb_request_frame = rtu.read_holding_registers(
+            self.mb_slave_id, register_addr, quantity
+        )
+        modbus_values = await self._get_modbus_response(mb_request_frame)
+        return modbus_values
+
+    async def read_input_register_formatted(self, register_addr, quantity, **kwargs):
+        """Read input registers from modbus slave and return single value (Modbus function code 4)"""
+        modbus_values = await self.read_input_registers(register_addr, quantity)
+        value = self._format_response(modbus_values, **kwargs)
+        return value
+
+    async def read_holding_register_formatted(self, register_addr, quantity, **kwargs):
+        """Read holding registers from modbus slave and return single value (Modbus function code 3)"""
+        modbus_values = await self.read_holding_registers(register_addr, quantity)
+        value = self._format_response(modbus_values, **kwargs)
+        return value
+
+    async def write_holding_register(self, register_addr, value, **kwargs):
+        """Write a single holding register to modbus slave (Modbus function code 6)"""
+        mb_request_frame = rtu.write_single_register(
+            self.mb_slave_id, register_addr, value
+        )
+        modbus_values = await self._get_modbus_response(mb_request_frame)
+        value = self._format_response(modbus_values, **kwargs)
+        return value
+
+    async def write_multiple_holding_registers(self, register_addr, values):
+        """Write list of multiple values to series of holding registers to modbus slave (Modbus function code 16)"""
+        mb_request_frame = rtu.write_multiple_registers(
+            self.mb_slave_id, register_addr, values
+        )
+        modbus_values = await self._get_modbus_response(mb_request_frame)
+        return modbus_values
+
+    async def read_coils(self, register_addr, quantity):
+        """Read coils from modbus slave and return list of coil values (Modbus function code 1)"""
+        mb_request_frame = rtu.read_coils(self.mb_slave_id, register_addr, quantity)
+        modbus_values = await self._get_modbus_response(mb_request_frame)
+        return modbus_values
+
+    async def read_discrete_inputs(self, register_addr, quantity):
+        """Read discrete inputs from modbus slave and return list of input values (Modbus function code 2)"""
+        mb_request_frame = rtu.read_discrete_inputs(
+            self.mb_slave_id, register_addr, quantity
+        )
+        modbus_values = await self._get_modbus_response(mb_request_frame)
+        return modbus_values
+
+    async def write_single_coil(self, register_addr, value):
+        """Write single coil value to modbus slave (Modbus function code 5)
+
+        Only valid values are 0xFF00 (On) and 0x0000 (Off)
+        """
+        mb_request_frame = rtu.write_single_coil(self.mb_slave_id, register_addr, value)
+        modbus_values = await self._get_modbus_response(mb_request_frame)
+        return modbus_values
+
+    async def send_raw_modbus_frame(self, mb_request_frame):
+        """Send raw modbus frame and return modbus response frame
+
+        Wrapper for internal method _send_receive_modbus_frame()
+        """
+        return bytes(await self._send_receive_modbus_frame(mb_request_frame))
+
+    async def send_raw_modbus_frame_parsed(self, mb_request_frame):
+        """Send raw modbus frame and return parsed modbusresponse list
+
+        Wrapper around internal method _get_modbus_response()
+        """
+        return await self._get_modbus_response(mb_request_frame)
@@ -0,0 +1,76 @@
+"""Decide which sensors are due to be polled on each tick."""
+from __future__ import annotations
+
+import logging
+import time
+from datetime import timedelta
+
+from .const import PollTier
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class PollScheduler:
+    """Tracks when each poll tier is next due, and backs off when the logger is unreachable
+
+    The coordinator ticks at the interval of the fastest tier; on each tick only
+    the tiers that are due are read. A tier only counts as polled when the read
+    succeeded, so everything is re-read as soon as the logger comes back.
+
+    After ``sleep_after`` consecutive failed polls (typically the logger losing
+    power at night) the scheduler goes to sleep: the tick interval doubles on
+    every further failure, up to ``max_sleep``, and returns to normal on the
+    first successful poll.
+    """
+
+    def __init__(self, tiers, sleep_after: int, max_sleep: timedelta) -> None:
+        self.tiers = sorted(set(tiers), key=lambda tier: tier.value)
+        self.sleep_after = sleep_after
+        self.max_sleep = max_sleep
+        self.failures = 0
+        self._next_due = {tier: 0.0 for tier in self.tiers}
+
+    @property
+    def tick_interval(self) -> timedelta:
+        """The interval of the fastest tier"""
+        return timedelta(seconds=self.tiers[0].value) if self.tiers else self.max_sleep
+
+    @property
+    def sleeping(self) -> bool:
+        return self.failures >= self.sleep_after
+
+    @property
+    def update_interval(self) -> timedelta:
+        """How long the coordinator should wait before the next tick"""
+        if not self.sleeping:
+            return self.tick_interval
+        # Stop doubling once past the cap: failures keep counting all night,
+        # and the timedelta would overflow
+        interval = self.tick_interval
+        for _ in range(self.failures - self.sleep_after + 1):
+            interval *= 2
+            if interval >= self.max_sleep:
+                return self.max_sleep
+        return interval
+
+    def due(self, now: float | None = None) -> list[PollTier]:
+        """The tiers due to be read at ``now``"""
+        if now is None:
+            now = time.monotonic()
+        # Allow for the coordinator firing slightly early
+        slack = self.tick_interval.total_seconds() / 2
+        return [tier for tier in self.tiers if self._next_due[tier] <= now + slack]
+
+    def record_success(self, tiers: list[PollTier], now: float | None = None) -> None:
+        if now is None:
+            now = time.monotonic()
+        for tier in tiers:
+            self._next_due[tier] = now + tier.value
+        if self.sleeping:
+            _LOGGER.debug('scheduler.py:PollScheduler: logger reachable again, waking up')
+        self.failures = 0
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures == self.sleep_after:
+            _LOGGER.debug('scheduler.py:PollScheduler: logger unreachable, going to sleep')
@@ -2,20 +2,25 @@
 from __future__ import annotations
 
 import logging
+import time
 
 from datetime import timedelta
+from functools import lru_cache
+from typing import Any, Callable, NamedTuple
 
 import asyncio
 import async_timeout
 
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, callback
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.util.dt import utc_from_timestamp
-from homeassistant.helpers.entity import DeviceInfo
+from homeassistant.util.dt import as_local, utc_from_timestamp
+from homeassistant.helpers.entity import DeviceInfo, EntityCategory
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
 from homeassistant.helpers.typing import ConfigType, DiscoveryInfoType
 from homeassistant.components.sensor import (
     SensorEntity,
+    STATE_CLASS_MEASUREMENT,
+    STATE_CLASS_TOTAL_INCREASING,
 )
 from homeassistant.helpers.update_coordinator import (
     CoordinatorEntity,
@@ -28,38 +33,82 @@ from homeassistant.const import (
     CONF_PORT,
     CONF_DEVICE,
     CONF_DEVICE_ID,
+    TIME_MILLISECONDS,
 )
 
 from .const import (
     DOMAIN,
-    Device,
-    SENSOR_DEFINITIONS,
+    DATA_FLEET,
+    CONF_GAP_TOLERANCE,
+    CONF_PIPELINE_WINDOW,
+    CONF_STALE_GRACE,
+    CONF_TRACE_FRAMES,
+    DEFAULT_GAP_TOLERANCE,
+    DEFAULT_PIPELINE_WINDOW,
+    DEFAULT_STALE_GRACE,
+    DEFAULT_TRACE_FRAMES,
+    HISTORY_DIAGNOSTICS_RECORDS,
+    HISTORY_RECORDS,
+    MODBUS_MAX_REGISTERS,
+    POLL_READ_TIMEOUT,
+    POLL_TIMEOUT,
+    SNAPSHOT_SAVE_DELAY,
+    SLEEP_AFTER_FAILURES,
+    MAX_SLEEP_INTERVAL,
 )
-
-from .pysolarmanv5.pysolarmanv5 import PySolarmanV5
+from .profiles import Device, DERIVED_DEFINITIONS, DEVICE_MAX_BLOCK_SIZE, SENSOR_DEFINITIONS
+
+from .connection import LoggerConnection, RequestBatch, REQUEST_ERRORS
+from .pysolarmanv5.pysolarmanv5 import V5FrameTrace, V5Metrics
+from .planner import PollPlan, describe_plan, tier_registers
+from .scheduler import PollScheduler
+from .snapshot import RegisterSnapshot
+from .counters import CounterFilter
+from .decoder import DeviceDecoder
+from .derived import DerivedEngine
+from .history import RegisterHistory
+from .storage import history_path, snapshot_store
+from .writer import RegisterWriter
 
 _LOGGER = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=None)
+def get_decoder(device: Device) -> DeviceDecoder:
+    """The decoder for a device, compiled on first use and shared by all inverters of that device"""
+    return DeviceDecoder(SENSOR_DEFINITIONS[device])
+
+
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry, async_add_entities: AddEntitiesCallback):
     """Config entry example."""
 
-    _LOGGER.debug(f'sensor.py:async_setup_entry:({entry.options})')
+    _LOGGER.debug('sensor.py:async_setup_entry:(%s)', entry.options)
+
+    fleet = hass.data[DOMAIN][DATA_FLEET]
+
+    async def async_poll():
+        # Note: asyncio.TimeoutError and aiohttp.ClientError are already
+        # handled by the data update coordinator.
+        async with async_timeout.timeout(POLL_TIMEOUT):
+            return await inverter.async_update_data()
 
     async def async_update_data():
         """Fetch data from API endpoint.
 
-        This is the place to pre-process the data to lookup tables
-        so entities can quickly look up their data.
+        Returns the value of every sensor keyed by sensor name; the
+        entities look their value up from coordinator.data.
         """
-        _LOGGER.debug(f'sensor.py:async_setup_entry.async_update_data: refresh')
+        _LOGGER.debug('sensor.py:async_setup_entry.async_update_data: refresh')
         try:
-            # Note: asyncio.TimeoutError and aiohttp.ClientError are already
-            # handled by the data update coordinator.
-            async with async_timeout.timeout(60):
-                return await inverter.async_update_data()
+            return await fleet.async_poll(entry.entry_id, async_poll)
         except OSError as err:
             raise UpdateFailed(f"Error communicating with inverter: {err}")
+        finally:
+            # Only read the fast tier on most ticks, and back off while the logger sleeps
+            coordinator.update_interval = inverter.update_interval
+
+    inverter = Inverter(hass, entry=entry, device=Device[entry.options[CONF_DEVICE]])
+    _LOGGER.debug('sensor.py:async_setup_entry: got inverter %s', inverter)
 
     coordinator = DataUpdateCoordinator(
         hass,
@@ -68,191 +117,551 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry, async_add_e
         name="sensor",
         update_method=async_update_data,
         # Polling interval. Will only be polled if there are subscribers.
-        update_interval=timedelta(seconds=30),
+        update_interval=inverter.update_interval,
     )
-    _LOGGER.debug(f'sensor.py:async_setup_entry: got update coordinator {coordinator}')
+    _LOGGER.debug('sensor.py:async_setup_entry: got update coordinator %s', coordinator)
 
-    inverter = Inverter(hass, entry=entry, device=Device[entry.options[CONF_DEVICE]])
-    _LOGGER.debug(f'sensor.py:async_setup_entry: got inverter {inverter}')
-
-    sensors = [SolarMANSensor(inverter=inverter, definition=definition, coordinator=coordinator) for definition in SENSOR_DEFINITIONS[inverter.device]]
+    definitions = SENSOR_DEFINITIONS[inverter.device] + DERIVED_DEFINITIONS[inverter.device]
+    sensors = [SolarMANSensor(inverter=inverter, definition=definition, coordinator=coordinator) for definition in definitions]
     inverter.set_sensors(sensors)
-    _LOGGER.debug(f'sensor.py:async_setup_entry: sensors created')
-
-    #
-    # Fetch initial data so we have data when entities subscribe
-    #
-    # If the refresh fails, async_config_entry_first_refresh will
-    # raise ConfigEntryNotReady and setup will try again later
-    #
-    # If you do not want to retry setup on failure, use
-    # coordinator.async_refresh() instead
-    #
-    _LOGGER.debug(f'sensor.py:async_setup_entry: first refresh')
-    await coordinator.async_config_entry_first_refresh()
-
-    async_add_entities(sensors)
+    diagnostic_sensors = [SolarMANDiagnosticSensor(inverter=inverter, definition=definition, coordinator=coordinator) for definition in DIAGNOSTIC_SENSORS]
+    _LOGGER.debug('sensor.py:async_setup_entry: %s sensors created', len(sensors))
+
+    await inverter.async_load()
+    fleet.register(entry.entry_id)
+    if inverter.restored:
+        # Start with the values saved before the restart, so entities come up
+        # straight away even if the logger is asleep; it is polled once the
+        # entities are added
+        _LOGGER.debug('sensor.py:async_setup_entry: restored %s registers', len(inverter.snapshot))
+        coordinator.async_set_updated_data(inverter.decode())
+    else:
+        #
+        # Fetch initial data so we have data when entities subscribe
+        #
+        # If the refresh fails, async_config_entry_first_refresh will
+        # raise ConfigEntryNotReady and setup will try again later
+        #
+        _LOGGER.debug('sensor.py:async_setup_entry: first refresh')
+        try:
+            await coordinator.async_config_entry_first_refresh()
+        except Exception:
+            fleet.unregister(entry.entry_id)
+            await inverter.async_close()
+            raise
+    hass.data[DOMAIN][entry.entry_id] = inverter
+    fleet.async_stagger(entry.entry_id, coordinator)
+
+    async_add_entities(sensors + diagnostic_sensors)
 
 class Inverter:
     """The solar inverter."""
 
     def __init__(self, hass: HomeAssistant, entry: ConfigEntry, device: str) -> None:
         """Init solar inverter."""
-        _LOGGER.debug(f'sensor.py:Inverter.__init__({entry.as_dict()})')
+        _LOGGER.debug('sensor.py:Inverter.__init__(%s)', entry.entry_id)
         self._hass = hass
         self.host = ""
         self.port = 0
         self.server = None
         self.data = {}
-        self.raw_data = []
+        # Survives failed polls, so sensors keep their last good value for a while
+        self.snapshot = RegisterSnapshot()
+        self.stale_sensors: set[str] = set()
+        self.stale_grace = DEFAULT_STALE_GRACE
+        self.restored = False
+        # Derived sensors; integrals keep their running totals here
+        self.derived = DerivedEngine(DERIVED_DEFINITIONS[device])
+        self.counters = CounterFilter(
+            SENSOR_DEFINITIONS[device], label=str(entry.options[CONF_DEVICE_ID]),
+            day=lambda timestamp: as_local(utc_from_timestamp(timestamp)).date(),
+        )
+        self._store = snapshot_store(hass, entry.entry_id)
+        # Created once the reads are planned, as its records fit the largest
+        self.history = None
+        self.plan = None
+        self.scheduler = None
         self.device = device
         self.sensor_list = []
         self.sensors_dict = {}
+        self._connection = None
+        # Kept across connections, so that reconfiguring doesn't reset the figures
+        self.metrics = V5Metrics()
+        self.frame_trace = None
+        self.polls = 0
+        self.failed_polls = 0
+        self.last_poll_round_trips = 0
+        self._last_due = []
+        self._last_blocks = 0
+        # Blocks that failed in the last poll, read again on the next one
+        self._deferred = []
+        self.failed_blocks = 0
+        # Held by polls and write batches, so that they never interleave
+        self._io_lock = asyncio.Lock()
+        self.writer = RegisterWriter(lambda request: self._connection.async_execute(request), self._io_lock)
         self.config(entry)
 
     def config(self, entry: ConfigEntry) -> None:
-        _LOGGER.debug(f'sensor.py:Inverter.config({entry.as_dict()})')
+        _LOGGER.debug('sensor.py:Inverter.config(%s): %s', entry.entry_id, entry.options)
         self.host = entry.options[CONF_HOST]
         self.port = entry.options[CONF_PORT]
         self.serial = entry.options[CONF_DEVICE_ID]
-        self._modbus = None
+        if self._connection:
+            self._hass.async_create_task(self._connection.async_close())
+        self.stale_grace = entry.options.get(CONF_STALE_GRACE, DEFAULT_STALE_GRACE)
+        trace_frames = entry.options.get(CONF_TRACE_FRAMES, DEFAULT_TRACE_FRAMES)
+        self.frame_trace = V5FrameTrace(trace_frames) if trace_frames else None
+        self._connection = LoggerConnection(
+            self.host, self.port, self.serial,
+            pipeline_window=entry.options.get(CONF_PIPELINE_WINDOW, DEFAULT_PIPELINE_WINDOW),
+            metrics=self.metrics,
+            frame_trace=self.frame_trace,
+        )
+        self.plan = PollPlan(
+            SENSOR_DEFINITIONS[self.device],
+            max_block_size=DEVICE_MAX_BLOCK_SIZE.get(self.device, MODBUS_MAX_REGISTERS),
+            gap_tolerance=entry.options.get(CONF_GAP_TOLERANCE, DEFAULT_GAP_TOLERANCE),
+        )
+        self._deferred = []
+        slots = self.plan.largest_block()
+        if self.history is None or self.history.slots != slots:
+            previous = self.history
+            self.history = RegisterHistory(history_path(self._hass, entry.entry_id), HISTORY_RECORDS, slots)
+            if previous is not None and previous.is_open:
+                self._hass.async_create_task(self._async_reopen_history(previous))
+        self.scheduler = PollScheduler(self.plan.tiers, sleep_after=SLEEP_AFTER_FAILURES, max_sleep=MAX_SLEEP_INTERVAL)
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug('sensor.py:Inverter.config: read plan for %s with every tier due: %s', self.serial, describe_plan(self.plan.blocks(self.plan.tiers)))
 
     def set_sensors(self, sensors: list[SolarMANSensor]):
         self.sensor_list = sensors
         self.sensors_dict = {sensor.name: sensor for sensor in sensors}
 
-    async def async_update_sensors(self):
-        _LOGGER.debug('sensor.py:Inverter.async_update_sensors')
-        _LOGGER.debug(f'sensor.py:Inverter.async_update_sensors: sensors: {self.sensor_list}')
-        await asyncio.gather(*[sensor.async_update_value(dict(enumerate(self.raw_data)).get(sensor.mb_offset)) for sensor in self.sensor_list])
-
-    def create_connection(self):
-        _LOGGER.debug(f'sensor.py:Inverter.create_connection: instantiating modbus interface')
-        # TODO: somehow we need to catch error from endpoint unavailable and mark entity as gone
-        # e.g. when the sun goes down and the logger is unpowered
-        if self._modbus and self._modbus.sock:
-            try:
-                self._modbus.sock.close()
-            except:
-                pass
-        self._modbus = PySolarmanV5(
-            address=self.host, serial=self.serial, port=self.port, mb_slave_id=1, verbose=1
+    def decode(self) -> dict[str, int | float | None]:
+        """The value of every sensor, derived ones included, keyed by sensor name
+
+        Sensors whose registers are missing, or expired from the snapshot,
+        are None. Implausible readings of counters are replaced by the last
+        plausible ones before anything is derived from them. A derived sensor
+        is stale if any of its inputs is.
+        """
+        expired = self.snapshot.expire(time.time())
+        if expired:
+            _LOGGER.debug('sensor.py:Inverter.decode: %s registers of %s expired', expired, self.serial)
+        values = get_decoder(self.device).decode(self.snapshot.registers)
+        read_at = self.snapshot.read_at
+        timestamps = {definition.name: read_at.get(definition.mb_offset) for definition in SENSOR_DEFINITIONS[self.device]}
+        self.counters.check(values, timestamps, self.snapshot.registers)
+        if self.derived.definitions:
+            self.derived.update(values, timestamps)
+            for definition in self.derived.definitions:
+                if self.stale_sensors.isdisjoint(definition.inputs):
+                    self.stale_sensors.discard(definition.name)
+                else:
+                    self.stale_sensors.add(definition.name)
+        return values
+
+    @property
+    def device_info(self) -> DeviceInfo:
+        """The device shared by all entities of this logger"""
+        return {
+            "identifiers": {(DOMAIN, self.serial)},
+            "name": f"SolarMAN Logger {self.serial}",
+            "manufacturer": "IGEN Tech",
+            "model": self.device.value,
+        }
+
+    @property
+    def connect_count(self) -> int:
+        return self._connection.connect_count
+
+    @property
+    def reconnect_count(self) -> int:
+        return self._connection.reconnect_count
+
+    @property
+    def planned_round_trips(self) -> int:
+        """The number of reads planned for the last poll, deferred blocks included"""
+        return self._last_blocks
+
+    @property
+    def update_interval(self) -> timedelta:
+        return self.scheduler.update_interval
+
+    def diagnostics(self) -> dict[str, Any]:
+        """The state of the connection and polling, for the diagnostics download"""
+        connection = self._connection
+        return {
+            "device": self.device.name,
+            "connection": {
+                "connected": connection.connected,
+                "connects": connection.connect_count,
+                "reconnects": connection.reconnect_count,
+                "connect_failures": connection.connect_failures,
+                "requests": connection.request_count,
+                "retries": connection.retry_count,
+                "pipeline_window": connection.pipeline_window,
+            },
+            "traffic": self.metrics.as_dict(),
+            "polling": {
+                "polls": self.polls,
+                "failed_polls": self.failed_polls,
+                "failed_blocks": self.failed_blocks,
+                "rejected_samples": self.counters.rejected,
+                "deferred_blocks": [str(block) for block in self._deferred],
+                "sleeping": self.scheduler.sleeping,
+                "update_interval": self.update_interval.total_seconds(),
+                "last_poll_round_trips": self.last_poll_round_trips,
+                "stale_grace": self.stale_grace,
+                "stale_sensors": sorted(self.stale_sensors),
+                "snapshot_registers": len(self.snapshot),
+                "snapshot_oldest": self.snapshot.oldest(),
+                "plan": {
+                    "+".join(sorted(tier.name for tier in tiers)): describe_plan(blocks)
+                    for tiers, blocks in self.plan.planned().items()
+                },
+            },
+            "updates": {
+                "emitted": sum(sensor.emitted_updates for sensor in self.sensor_list),
+                "suppressed": sum(sensor.suppressed_updates for sensor in self.sensor_list),
+                "sensors": {
+                    sensor.name: {"emitted": sensor.emitted_updates, "suppressed": sensor.suppressed_updates}
+                    for sensor in self.sensor_list
+                },
+            },
+            "history": {
+                "records": len(self.history),
+                "capacity": self.history.capacity,
+                "span": self.history.span(),
+                "recent": [record._asdict() for record in self.history.latest(HISTORY_DIAGNOSTICS_RECORDS)],
+            },
+            "frames": self.frame_trace.dump() if self.frame_trace is not None else None,
+        }
+
+    async def async_load(self) -> None:
+        """Open the history, and restore the snapshot saved before a restart
+
+        Without a saved snapshot (e.g. Home Assistant stopped before it was
+        first saved), the snapshot is rebuilt from the newest value of each
+        register in the history instead. Restored values are stale until read
+        again, and are kept for the grace period.
+        """
+        try:
+            await self._hass.async_add_executor_job(self.history.open)
+        except (OSError, ValueError) as err:
+            _LOGGER.warning('Register history of %s is not kept: %s', self.serial, err)
+        expires_at = time.time() + self.stale_grace
+        stored = await self._store.async_load()
+        if stored and stored.get("device") == self.device.name:
+            self.snapshot.restore(stored["registers"], expires_at)
+            self.derived.restore(stored.get("derived", {}))
+        else:
+            registers = await self._hass.async_add_executor_job(self.history.last_values)
+            _LOGGER.debug('sensor.py:Inverter.async_load: no saved snapshot, %s registers from the history', len(registers))
+            self.snapshot.restore(registers, expires_at)
+        if not len(self.snapshot):
+            return
+        self.stale_sensors.update(definition.name for definition in SENSOR_DEFINITIONS[self.device])
+        self.restored = len(self.snapshot) > 0
+
+    async def _async_reopen_history(self, previous: RegisterHistory) -> None:
+        """Replace the history of another record size, which starts it afresh"""
+        await self._hass.async_add_executor_job(previous.close)
+        try:
+            await self._hass.async_add_executor_job(self.history.open)
+        except (OSError, ValueError) as err:
+            _LOGGER.warning('Register history of %s is not kept: %s', self.serial, err)
+
+    def _stored_data(self) -> dict[str, Any]:
+        return {"device": self.device.name, "registers": self.snapshot.as_dict(), "derived": self.derived.state()}
+
+    async def async_close(self):
+        await self._connection.async_close()
+        await self._store.async_save(self._stored_data())
+        await self._hass.async_add_executor_job(self.history.close)
+
+    async def _async_read_block(self, block, batch: RequestBatch):
+        values = await self._connection.async_execute(
+            lambda client: client.read_holding_registers(register_addr=block.start, quantity=block.count),
+            batch,
         )
-        _LOGGER.debug(f'sensor.py:Inverter.create_connection: modbus interface instantiated')
+        return dict(zip(range(block.start, block.end), values))
 
-    def _get_modbus_size(self):
-        # the size is the maximum offset plus the size of that register
-        # sensors are ordered by their offset, so just grab the last one
-        return self.sensor_list[-1].mb_offset + self.sensor_list[-1].mb_size
+    async def _async_read_blocks(self, blocks) -> list:
+        """Read blocks as one batch, returning each block's values or error
 
-    def retrieve_raw_data(self):
-        _LOGGER.debug('sensor.py:Inverter.retrieve_raw_data')
-        self.create_connection()
+        Once a read times out the rest of the batch is deferred rather than
+        each waiting out its own timeout. Reads still unfinished after
+        POLL_READ_TIMEOUT are cancelled and failed with a timeout, and the
+        connection is dropped, since it may be left mid-request.
+        """
+        batch = RequestBatch()
+        tasks = [asyncio.ensure_future(self._async_read_block(block, batch)) for block in blocks]
+        if not tasks:
+            return []
+        _, pending = await asyncio.wait(tasks, timeout=POLL_READ_TIMEOUT)
+        if pending:
+            _LOGGER.debug('sensor.py:Inverter._async_read_blocks: %s reads of %s unfinished after %ss', len(pending), self.serial, POLL_READ_TIMEOUT)
+            for task in pending:
+                task.cancel()
+            await asyncio.wait(pending)
+            await self._connection.async_close()
+        return [
+            asyncio.TimeoutError(f"Read not finished within {POLL_READ_TIMEOUT}s") if task.cancelled()
+            else task.exception() or task.result()
+            for task in tasks
+        ]
+
+    async def async_retrieve_raw_data(self):
+        """Read the sensors of the due tiers, and any blocks deferred from the last poll
+
+        Each block succeeds or fails on its own; the connection has already
+        retried it as far as the error allows. The blocks that were read are
+        merged into the snapshot, and the ones that failed are deferred to the
+        next poll, so a noisy link only leaves the sensors of a few blocks
+        stale. The poll only counts as failed if no block could be read.
+        """
+        _LOGGER.debug('sensor.py:Inverter.async_retrieve_raw_data')
+        self.polls += 1
+        self._last_due = self.scheduler.due()
+        requests_before = self._connection.request_count
+        now = time.time()
         data = {}
-        try:
-            data = self._modbus.read_holding_registers(register_addr=0, quantity=self._get_modbus_size())
-        except IOError as e:
-            _LOGGER.debug('Exception reading registers')
-            _LOGGER.debug(e)
-        except OSError as e:
-            _LOGGER.debug('Exception reading registers')
-            _LOGGER.debug(e)
-        _LOGGER.debug(f'sensor.py:Inverter.retrieve_raw_data: raw_data: {data}')
-        self.raw_data = data
+        blocks = list(self.plan.blocks(self._last_due))
+        # Unless their sensors are read with the due tiers anyway
+        blocks += [
+            block for block in self._deferred
+            if any(definition.poll_tier not in self._last_due for definition in block.definitions)
+        ]
+        self._last_blocks = len(blocks)
+        # Lock-step connections run these one at a time, pipelined ones concurrently
+        async with self._io_lock:
+            results = await self._async_read_blocks(blocks)
+        failed = []
+        for block, result in zip(blocks, results):
+            if isinstance(result, BaseException):
+                if not isinstance(result, REQUEST_ERRORS):
+                    raise result
+                _LOGGER.debug('sensor.py:Inverter.async_retrieve_raw_data: reading %s failed: %r', block, result)
+                failed.append((block, result))
+                # The last good values are kept until they expire from the snapshot
+                self.stale_sensors.update(definition.name for definition in block.definitions)
+                continue
+            # Kept until their next read is overdue by the grace period
+            for tier, registers in tier_registers(block).items():
+                self.snapshot.update({register: result[register] for register in registers}, now, tier.value + self.stale_grace)
+            self.history.append(now, block.start, list(result.values()))
+            self.stale_sensors.difference_update(definition.name for definition in block.definitions)
+            data.update(result)
+        self.failed_blocks += len(failed)
+        if data:
+            self._store.async_delay_save(self._stored_data, SNAPSHOT_SAVE_DELAY)
+
+        if failed and len(failed) == len(blocks):
+            error = failed[0][1]
+            self.failed_polls += 1
+            self.scheduler.record_failure()
+            # The tiers are still due, so the deferred blocks are read with them
+            self._deferred = []
+            # Only the first failure: while the logger sleeps every poll fails
+            if self.frame_trace is not None and self.scheduler.failures == 1:
+                _LOGGER.warning('Polling %s failed (%r), last %s frames:\n%s', self.serial, error, len(self.frame_trace), "\n".join(self.frame_trace.dump()))
+        else:
+            # registers of the tiers that were not due keep their previous values
+            self.scheduler.record_success(self._last_due)
+            self._deferred = [block for block, _ in failed]
+        self.last_poll_round_trips = self._connection.request_count - requests_before
+        if _LOGGER.isEnabledFor(logging.DEBUG):
+            _LOGGER.debug('sensor.py:Inverter.async_retrieve_raw_data: tiers %s, %s of %s blocks failed, %s round trips (planned %s)', [tier.name for tier in self._last_due], len(failed), len(blocks), self.last_poll_round_trips, self.planned_round_trips)
+            _LOGGER.debug('sensor.py:Inverter.async_retrieve_raw_data: raw_data: %s', data)
+
+    async def async_write_registers(self, registers: dict[int, int], verify: bool = False) -> None:
+        """Write holding registers, batched with any other writes queued for this logger"""
+        await self.writer.async_write(registers, verify)
 
     async def async_update_data(self):
         _LOGGER.debug('sensor.py:Inverter.async_update_data')
-        self.retrieve_raw_data()
-        await self.async_update_sensors()
-        return self.sensor_list
+        await self.async_retrieve_raw_data()
+        return self.decode()
 
 
 class SolarMANSensor(CoordinatorEntity, SensorEntity):
     """Representation of a SolarMAN logger device."""
 
+    _attr_should_poll = False
+
     def __init__(self, inverter, definition, coordinator):
-        """Initialize the sensor."""
+        """Initialize the sensor.
+
+        The entity attributes never change, so they are set once here rather
+        than looked up through the definition on every state write.
+        """
 
-        _LOGGER.debug(f'sensor.py:SolarMANSensor.__init__({definition})')
-        _LOGGER.debug(f'sensor.py:SolarMANSensor.__init__: name: {definition.name}, device_class: {definition.device_class}, state_class: {definition.state_class}, unit: {definition.unit}, mb_offset: {definition.mb_offset}, mb_size: {definition.mb_size}, mb_mult: {definition.mb_mult}')
+        _LOGGER.debug('sensor.py:SolarMANSensor.__init__(%s)', definition)
 
         self._inverter = inverter
         self._definition = definition
         self.coordinator = coordinator
 
-        self.online = False
-        self.raw_value = None
+        self._attr_unique_id = f"{DOMAIN}_{inverter.serial}_{definition.name}"
+        self._attr_name = f'{inverter.serial} {definition.name}'
+        self._attr_device_class = definition.device_class
+        self._attr_state_class = definition.state_class
+        self._attr_native_unit_of_measurement = definition.unit
+        self._attr_device_info = inverter.device_info
 
-    async def async_update_value(self, value):
-        _LOGGER.debug(f'sensor.py:SolarMANSensor.async_update_value({value})')
-        self.raw_value = value
-        if value:
-            self.online = True
-        else:
-            self.online = False
-        _LOGGER.debug(f'sensor.py:SolarMANSensor.async_update_value: name: {self.name}, raw_value: {value}, value: {self.value}{self.native_unit_of_measurement}')
-        await self.coordinator.async_request_refresh()
-
-    @property
-    def mb_size(self):
-        return self._definition.mb_size
+        self.online = False
+        self.stale = False
+        self._value = None
+        self._attr_native_value = None
+        self._attr_extra_state_attributes = None
+        self._written_at = 0.0
+        self.emitted_updates = 0
+        self.suppressed_updates = 0
+
+    def _within_deadband(self, value) -> bool:
+        """True if value differs from the written value too little to be worth writing"""
+        definition = self._definition
+        if value is None or self._value is None:
+            return False
+        delta = abs(value - self._value)
+        if delta > definition.deadband_abs and delta > definition.deadband_rel * abs(self._value):
+            return False
+        if definition.max_silence is not None and time.monotonic() - self._written_at >= definition.max_silence:
+            return False
+        return True
+
+    def update_value(self, value, stale: bool = False) -> bool:
+        """Take a new decoded value, returning True if the state should be written
+
+        None means there is no value, and the sensor is unavailable; 0 is a
+        reading like any other. A stale value is the last good one, kept
+        while reads fail, and is flagged in the state attributes.
+
+        Changes in availability or staleness are always written; changes in
+        value only if they are outside the sensor's deadband, or if the last
+        write was longer than max_silence ago.
+        """
+        online = value is not None
+        stale = stale and online
+        if online == self.online and stale == self.stale and (value == self._value or self._within_deadband(value)):
+            if value != self._value:
+                self.suppressed_updates += 1
+            return False
+        self._value = value
+        self._attr_native_value = value
+        self.online = online
+        self.stale = stale
+        self._attr_extra_state_attributes = {"stale": True} if stale else None
+        self._written_at = time.monotonic()
+        self.emitted_updates += 1
+        return True
+
+    def _update_from_coordinator(self) -> bool:
+        if self.coordinator.data is None:
+            return self.update_value(None)
+        name = self._definition.name
+        return self.update_value(self.coordinator.data.get(name), name in self._inverter.stale_sensors)
+
+    async def async_added_to_hass(self) -> None:
+        await super().async_added_to_hass()
+        self._update_from_coordinator()
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Write state only when the value has actually changed"""
+        if self._update_from_coordinator():
+            self.async_write_ha_state()
 
     @property
-    def mb_offset(self):
-        return self._definition.mb_offset
+    def available(self) -> bool:
+        """Return True if entity is available."""
+        return self.online
 
-    @property
-    def value(self):
-        if self.raw_value:
-            return self.raw_value * self._definition.mb_mult
-        return None
 
-    @property
-    def unique_id(self):
-        """Return unique id."""
-        return f"{DOMAIN}_{self._inverter.serial}_{self._definition.name}"
+def _milliseconds(seconds: float | None) -> int | None:
+    return None if seconds is None else round(seconds * 1000)
+
+
+class DiagnosticDefinition(NamedTuple):
+    """A diagnostic sensor reporting on the health of a logger's connection
+
+    :param key: Identifies the sensor in its unique id
+    :param name: The human-readable name of the sensor
+    :param unit: The units of the value
+    :param state_class: The HomeAssistant class of the sensor's state
+    :param value: Gets the value from the Inverter
+    :param attributes: Optionally gets extra state attributes from the Inverter
+    """
+    key: str
+    name: str
+    unit: str | None
+    state_class: str
+    value: Callable[[Inverter], Any]
+    attributes: Callable[[Inverter], dict[str, Any]] | None = None
+
+
+DIAGNOSTIC_SENSORS = (
+    DiagnosticDefinition("rtt", "Round Trip Time", TIME_MILLISECONDS, STATE_CLASS_MEASUREMENT,
+                         lambda inverter: _milliseconds(inverter.metrics.rtt_last)),
+    DiagnosticDefinition("connect_time", "Connect Time", TIME_MILLISECONDS, STATE_CLASS_MEASUREMENT,
+                         lambda inverter: _milliseconds(inverter.metrics.connect_time)),
+    DiagnosticDefinition("reconnects", "Reconnects", None, STATE_CLASS_TOTAL_INCREASING,
+                         lambda inverter: inverter.reconnect_count),
+    DiagnosticDefinition("timeouts", "Timeouts", None, STATE_CLASS_TOTAL_INCREASING,
+                         lambda inverter: inverter.metrics.timeouts),
+    DiagnosticDefinition("frame_errors", "Frame Errors", None, STATE_CLASS_TOTAL_INCREASING,
+                         lambda inverter: inverter.metrics.frame_error_count,
+                         lambda inverter: dict(inverter.metrics.frame_errors)),
+    DiagnosticDefinition("failed_polls", "Failed Polls", None, STATE_CLASS_TOTAL_INCREASING,
+                         lambda inverter: inverter.failed_polls),
+    DiagnosticDefinition("rejected_samples", "Rejected Samples", None, STATE_CLASS_TOTAL_INCREASING,
+                         lambda inverter: inverter.counters.rejected_count,
+                         lambda inverter: inverter.counters.rejected),
+)
 
-    @property
-    def name(self):
-        """Name of this inverter attribute."""
-        return f'{self._inverter.serial} {self._definition.name}'
 
-    @property
-    def device_class(self):
-        """State of this inverter attribute."""
-        return self._definition.device_class
+class SolarMANDiagnosticSensor(CoordinatorEntity, SensorEntity):
+    """Connection health of a logger, for finding slow or flaky sticks.
 
-    @property
-    def state_class(self):
-        """State of this inverter attribute."""
-        return self._definition.state_class
+    Disabled by default; enable the ones of interest in the entity registry.
+    """
 
-    @property
-    def native_unit_of_measurement(self):
-        """Return the unit of measurement."""
-        return self._definition.unit
+    _attr_should_poll = False
+    _attr_entity_category = EntityCategory.DIAGNOSTIC
+    _attr_entity_registry_enabled_default = False
 
-    @property
-    def native_value(self):
-        """State of this inverter attribute."""
-        return self.value
+    def __init__(self, inverter, definition, coordinator):
+        self._inverter = inverter
+        self._definition = definition
+        self.coordinator = coordinator
 
-    @property
-    def should_poll(self) -> bool:
-        """No polling needed."""
-        return False
+        self._attr_unique_id = f"{DOMAIN}_{inverter.serial}_diagnostic_{definition.key}"
+        self._attr_name = f'{inverter.serial} {definition.name}'
+        self._attr_native_unit_of_measurement = definition.unit
+        self._attr_state_class = definition.state_class
+        self._attr_device_info = inverter.device_info
+        self._attr_native_value = None
+        self._attr_extra_state_attributes = None
+        self._update()
+
+    def _update(self) -> bool:
+        """Refresh the value and attributes, returning True if either changed"""
+        value = self._definition.value(self._inverter)
+        attributes = self._definition.attributes(self._inverter) if self._definition.attributes else None
+        if value == self._attr_native_value and attributes == self._attr_extra_state_attributes:
+            return False
+        self._attr_native_value = value
+        self._attr_extra_state_attributes = attributes
+        return True
+
+    @callback
+    def _handle_coordinator_update(self) -> None:
+        """Failed polls update the coordinator's listeners too, so errors show up while the logger is unreachable"""
+        if self._update():
+            self.async_write_ha_state()
 
     @property
     def available(self) -> bool:
-        """Return True if entity is available."""
-        return self.online
-
-    @property
-    def device_info(self) -> DeviceInfo:
-        """Information about this device."""
-        return {
-            "identifiers": {(DOMAIN, self._inverter.serial)},
-            "name": f"SolarMAN Logger {self._inverter.serial}",
-            "manufacturer": "IGEN Tech",
-            "model": self._inverter.device.value,
-        }
+        """Diagnostics stay available when the logger is not"""
+        return True
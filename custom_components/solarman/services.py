@@ -0,0 +1,57 @@
+"""Services for the SolarMAN logger integration."""
+from __future__ import annotations
+
+import asyncio
+import logging
+
+import voluptuous as vol
+from umodbus.client.serial.redundancy_check import CRCError
+from umodbus.exceptions import ModbusError
+
+from homeassistant.core import HomeAssistant, ServiceCall
+from homeassistant.exceptions import HomeAssistantError
+
+from .const import (
+    DOMAIN,
+    DATA_FLEET,
+    SERVICE_WRITE_REGISTERS,
+    ATTR_SERIAL,
+    ATTR_REGISTERS,
+    ATTR_VERIFY,
+)
+from .pysolarmanv5.pysolarmanv5 import V5FrameError
+from .writer import WriteVerificationError
+
+_LOGGER = logging.getLogger(__name__)
+
+_REGISTER = vol.All(vol.Coerce(int), vol.Range(min=0, max=0xFFFF))
+
+WRITE_REGISTERS_SCHEMA = vol.Schema(
+    {
+        vol.Required(ATTR_SERIAL): vol.Coerce(int),
+        vol.Required(ATTR_REGISTERS): vol.All({_REGISTER: _REGISTER}, vol.Length(min=1)),
+        vol.Optional(ATTR_VERIFY, default=False): bool,
+    }
+)
+
+
+def async_setup_services(hass: HomeAssistant) -> None:
+    """Register the integration's services"""
+
+    async def async_write_registers(call: ServiceCall) -> None:
+        serial = call.data[ATTR_SERIAL]
+        inverter = next(
+            (inverter for key, inverter in hass.data[DOMAIN].items() if key != DATA_FLEET and inverter.serial == serial),
+            None,
+        )
+        if inverter is None:
+            raise HomeAssistantError(f"No data logger with serial number {serial} is set up")
+        _LOGGER.debug('services.py:async_write_registers: %s: %s', serial, call.data[ATTR_REGISTERS])
+        try:
+            await inverter.async_write_registers(call.data[ATTR_REGISTERS], verify=call.data[ATTR_VERIFY])
+        except (OSError, asyncio.TimeoutError, V5FrameError, CRCError, ModbusError, WriteVerificationError) as err:
+            raise HomeAssistantError(f"Writing to data logger {serial} failed: {err!r}") from err
+
+    hass.services.async_register(
+        DOMAIN, SERVICE_WRITE_REGISTERS, async_write_registers, schema=WRITE_REGISTERS_SCHEMA
+    )
@@ -0,0 +1,328 @@
+""" A simulated Solarman V5 data logger, for exercising the client without a real stick.
+
+Speaks the V5 framing over TCP and answers Modbus register reads and writes
+from an in-memory register map. Faults seen on real loggers can be injected:
+latency, responses split across TCP segments, spurious 0x1047 frames, dropped
+requests and dropped connections.
+
+Run from this directory, e.g.
+
+    python simulator.py --serial 1773158214 --latency 0.05 --spurious 0.1
+
+and point the integration (or test.py) at 127.0.0.1:8899. Pass --device LSW3
+to serve plausible values for the sensors in that device's profile, and
+--discovery-port 48899 to also answer the UDP discovery broadcast.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import struct
+from dataclasses import dataclass
+from pathlib import Path
+from types import SimpleNamespace
+
+import yaml
+
+from umodbus.client.serial.redundancy_check import add_crc
+
+_LOGGER = logging.getLogger(__name__)
+
+V5_START = 0xA5
+V5_END = 0x15
+V5_CONTROLCODE_RESPONSE = bytes.fromhex("1015")
+V5_CONTROLCODE_HEARTBEAT = bytes.fromhex("1047")
+V5_HEADER_LEN = 11
+DISCOVERY_MESSAGE = b"WIFIKIT-214028-READ"
+
+# Typical readings by unit, used to fill a register map from sensor definitions
+TYPICAL_VALUES = {
+    "V": 240,
+    "A": 4.5,
+    "W": 1800,
+    "kW": 1.8,
+    "Hz": 50,
+    "°C": 38,
+    "kWh": 12345,
+    "h": 6789,
+}
+# Typical readings of sensors that differ from others in the same unit
+TYPICAL_NAMED_VALUES = {
+    "Energy Today": 12.3,
+}
+
+
+@dataclass
+class Faults:
+    """Faults to inject, as probabilities per request unless noted
+
+    :param latency: Seconds to wait before answering
+    :param jitter: Up to this many seconds are added to latency at random
+    :param split: Send responses in chunks of this many bytes (0 to send whole)
+    :param spurious: Precede the response with a spurious 0x1047 frame
+    :param drop: Never answer the request
+    :param disconnect: Close the connection instead of answering
+    """
+    latency: float = 0.0
+    jitter: float = 0.0
+    split: int = 0
+    spurious: float = 0.0
+    drop: float = 0.0
+    disconnect: float = 0.0
+
+
+def register_map(definitions):
+    """A register map with a plausible value for each sensor definition
+
+    Values are clamped to what the sensor's registers can hold.
+    """
+    registers = {}
+    for definition in definitions:
+        typical = TYPICAL_NAMED_VALUES.get(definition.name, TYPICAL_VALUES.get(str(definition.unit), 1))
+        raw = int(round(typical / definition.mb_mult))
+        count = max(1, (definition.mb_size + 1) // 2)
+        bits = 16 * count
+        if getattr(definition, "mb_signed", False):
+            raw = max(-(1 << (bits - 1)), min(raw, (1 << (bits - 1)) - 1))
+        else:
+            raw = max(0, min(raw, (1 << bits) - 1))
+        words = [(raw >> (16 * i)) & 0xFFFF for i in range(count)]
+        if getattr(definition, "mb_word_order", "big") == "big":
+            words.reverse()
+        for i, word in enumerate(words):
+            registers[definition.mb_offset + i] = word
+    return registers
+
+
+def device_register_map(device_name):
+    """The register map for a device profile in profiles/, e.g. 'LSW3'
+
+    Reads the YAML directly rather than through profiles.py, so that the
+    simulator runs without Home Assistant.
+    """
+    for path in sorted((Path(__file__).parent / "profiles").glob("*.yaml")):
+        profile = yaml.safe_load(path.read_text(encoding="utf-8"))
+        if profile.get("device") == device_name:
+            break
+    else:
+        raise KeyError(f"No profile for device {device_name}")
+    return register_map(
+        SimpleNamespace(
+            name=sensor["name"],
+            unit=sensor.get("unit"),
+            mb_offset=sensor["register"],
+            mb_size=4 if sensor.get("type", "u16").endswith("32") else 2,
+            mb_signed=sensor.get("type", "u16").startswith("s"),
+            mb_mult=sensor.get("scale", 1),
+            mb_word_order=sensor.get("word_order", "big"),
+        )
+        for sensor in profile["sensors"]
+    )
+
+
+class SimulatedLogger:
+    """A single simulated data logger"""
+
+    def __init__(self, serial, registers=None, faults=None, mb_slave_id=1, seed=None):
+        self.serial = serial
+        self.registers = dict(registers or {})
+        self.faults = faults or Faults()
+        self.mb_slave_id = mb_slave_id
+        self.requests = 0
+        self.connections = 0
+        self.server = None
+        self._random = random.Random(seed)
+        self._sequence = 0
+        self._loggerserial = struct.pack("<I", int(serial))
+
+    @property
+    def port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+    @property
+    def mac(self):
+        return f"98D863{int(self.serial) & 0xFFFFFF:06X}"
+
+    async def start(self, host="127.0.0.1", port=0):
+        """Start listening; port 0 picks a free port"""
+        self.server = await asyncio.start_server(self._handle_connection, host, port)
+        return self
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def _frame(self, controlcode, serial, payload):
+        frame = bytearray(
+            bytes([V5_START])
+            + len(payload).to_bytes(2, byteorder="little")
+            + controlcode
+            + serial
+            + self._loggerserial
+            + payload
+            + bytes([0, V5_END])
+        )
+        frame[-2] = sum(frame[1:-2]) & 0xFF
+        return bytes(frame)
+
+    def _modbus_response(self, request):
+        """Answer a Modbus RTU request frame; None if it is not for us"""
+        slave_id, function = request[0], request[1]
+        if slave_id != self.mb_slave_id:
+            return None
+        if function in (3, 4):
+            address, quantity = struct.unpack(">HH", request[2:6])
+            values = [self.registers.get(address + i, 0) for i in range(quantity)]
+            pdu = bytes([function, quantity * 2]) + struct.pack(f">{quantity}H", *values)
+        elif function == 6:
+            address, value = struct.unpack(">HH", request[2:6])
+            self.registers[address] = value
+            pdu = request[1:6]
+        elif function == 16:
+            address, quantity = struct.unpack(">HH", request[2:6])
+            values = struct.unpack(f">{quantity}H", request[7 : 7 + quantity * 2])
+            for i, value in enumerate(values):
+                self.registers[address + i] = value
+            pdu = request[1:6]
+        else:
+            # Illegal function exception
+            pdu = bytes([function | 0x80, 0x01])
+        return add_crc(bytes([slave_id]) + pdu)
+
+    async def _send(self, writer, data):
+        split = self.faults.split
+        if not split:
+            writer.write(data)
+            await writer.drain()
+            return
+        for i in range(0, len(data), split):
+            writer.write(data[i : i + split])
+            await writer.drain()
+            await asyncio.sleep(0)
+
+    async def _handle_request(self, writer, frame, send_lock):
+        """Answer one request. Requests on a connection are answered
+        concurrently, so with jitter replies may go out of order."""
+        faults = self.faults
+        self.requests += 1
+        if self._random.random() < faults.drop:
+            return
+        if self._random.random() < faults.disconnect:
+            writer.close()
+            return
+        delay = faults.latency + self._random.random() * faults.jitter
+        if delay:
+            await asyncio.sleep(delay)
+
+        modbus_response = self._modbus_response(frame[26:-2])
+        if modbus_response is None:
+            return
+        # Echo the request's sequence number, followed by our own
+        self._sequence = (self._sequence + 1) & 0xFF
+        serial = bytes([frame[5], self._sequence])
+        payload = bytes([0x02, 0x01]) + bytes(12) + modbus_response
+        data = self._frame(V5_CONTROLCODE_RESPONSE, serial, payload)
+        if self._random.random() < faults.spurious:
+            data = self._frame(V5_CONTROLCODE_HEARTBEAT, serial, bytes([0x00, 0x01])) + data
+        async with send_lock:
+            if not writer.is_closing():
+                await self._send(writer, data)
+
+    async def _handle_connection(self, reader, writer):
+        self.connections += 1
+        buffer = bytearray()
+        send_lock = asyncio.Lock()
+        tasks = set()
+        try:
+            while not writer.is_closing():
+                data = await reader.read(1024)
+                if not data:
+                    break
+                buffer += data
+                while len(buffer) >= V5_HEADER_LEN:
+                    if buffer[0] != V5_START:
+                        del buffer[0]
+                        continue
+                    frame_len = V5_HEADER_LEN + int.from_bytes(buffer[1:3], byteorder="little") + 2
+                    if len(buffer) < frame_len:
+                        break
+                    frame = bytes(buffer[:frame_len])
+                    del buffer[:frame_len]
+                    task = asyncio.create_task(self._handle_request(writer, frame, send_lock))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+        except ConnectionError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+
+class DiscoveryResponder(asyncio.DatagramProtocol):
+    """Answers the UDP discovery broadcast on behalf of simulated loggers
+
+    Real loggers each answer from their own address; here they all report
+    ``ip``, so they are told apart by serial number only.
+    """
+
+    def __init__(self, loggers, ip):
+        self.loggers = loggers
+        self.ip = ip
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        if data.strip() != DISCOVERY_MESSAGE:
+            return
+        for logger in self.loggers:
+            self.transport.sendto(f"{self.ip},{logger.mac},{logger.serial}".encode(), addr)
+
+
+async def _main(args):
+    registers = device_register_map(args.device) if args.device else {i: i for i in range(args.registers)}
+    faults = Faults(
+        latency=args.latency, jitter=args.jitter, split=args.split,
+        spurious=args.spurious, drop=args.drop, disconnect=args.disconnect,
+    )
+    loggers = []
+    for i in range(args.count):
+        logger = SimulatedLogger(args.serial + i, registers, faults)
+        await logger.start(args.host, args.port + i if args.port else 0)
+        print(f"Simulated logger {logger.serial} listening on {args.host}:{logger.port}")
+        loggers.append(logger)
+    if args.discovery_port:
+        await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: DiscoveryResponder(loggers, args.host), local_addr=("0.0.0.0", args.discovery_port)
+        )
+        print(f"Answering discovery on UDP port {args.discovery_port}")
+    await asyncio.gather(*(logger.server.serve_forever() for logger in loggers))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8899, help="first port; 0 picks free ports")
+    parser.add_argument("--serial", type=int, default=1773158214, help="first logger serial")
+    parser.add_argument("--count", type=int, default=1, help="number of loggers, on consecutive ports and serials")
+    parser.add_argument("--device", help="serve values for this device's sensors, e.g. LSW3")
+    parser.add_argument("--discovery-port", type=int, help="answer discovery broadcasts on this UDP port, e.g. 48899")
+    parser.add_argument("--registers", type=int, default=256, help="without --device, serve this many registers")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--split", type=int, default=0)
+    parser.add_argument("--spurious", type=float, default=0.0)
+    parser.add_argument("--drop", type=float, default=0.0)
+    parser.add_argument("--disconnect", type=float, default=0.0)
+    try:
+        asyncio.run(_main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Keep the last good register values of a logger through failed polls."""
+from __future__ import annotations
+
+
+class RegisterSnapshot:
+    """The last good value of every register read from a logger
+
+    Each register is stamped with the time it was read and kept until an
+    expiry time set by whoever read it: normally the time of its next
+    scheduled read plus a grace period. Until then a failed read leaves the
+    last good value in place (stale), rather than blanking it; once expired
+    the register is dropped and its sensors become unavailable.
+
+    Times are seconds since the epoch, as from time.time().
+    """
+
+    def __init__(self) -> None:
+        self.registers: dict[int, int] = {}
+        self.read_at: dict[int, float] = {}
+        self._expires_at: dict[int, float] = {}
+
+    def __len__(self) -> int:
+        return len(self.registers)
+
+    def update(self, data: dict[int, int], now: float, lifetime: float) -> None:
+        """Store freshly read register values, to be kept for ``lifetime`` seconds"""
+        self.registers.update(data)
+        expires_at = now + lifetime
+        for register in data:
+            self.read_at[register] = now
+            self._expires_at[register] = expires_at
+
+    def expire(self, now: float) -> int:
+        """Drop the registers whose values are too old to trust, returning how many"""
+        expired = [register for register, expires_at in self._expires_at.items() if expires_at < now]
+        for register in expired:
+            del self.registers[register]
+            del self.read_at[register]
+            del self._expires_at[register]
+        return len(expired)
+
+    def oldest(self) -> float | None:
+        """The time the least recently read register was read; None if there are none"""
+        return min(self.read_at.values(), default=None)
+
+    def as_dict(self) -> dict[str, list]:
+        """The registers and when they were read, as JSON-serialisable data"""
+        return {str(register): [value, self.read_at[register]] for register, value in self.registers.items()}
+
+    def restore(self, data: dict[str, list], expires_at: float) -> None:
+        """Restore registers saved with as_dict(), to be kept until ``expires_at``"""
+        for register, (value, read_at) in data.items():
+            register = int(register)
+            self.registers[register] = value
+            self.read_at[register] = read_at
+            self._expires_at[register] = expires_at
@@ -0,0 +1,34 @@
+"""Where the state of each logger is kept across restarts."""
+from __future__ import annotations
+
+import logging
+from pathlib import Path
+
+from homeassistant.core import HomeAssistant
+from homeassistant.helpers.storage import STORAGE_DIR, Store
+
+from .const import DOMAIN, STORAGE_VERSION
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def snapshot_store(hass: HomeAssistant, entry_id: str) -> Store:
+    """The store holding the last register snapshot of a logger"""
+    return Store(hass, STORAGE_VERSION, f"{DOMAIN}.{entry_id}")
+
+
+def history_path(hass: HomeAssistant, entry_id: str) -> Path:
+    """The file holding the register history of a logger"""
+    return Path(hass.config.path(STORAGE_DIR, f"{DOMAIN}.{entry_id}.history"))
+
+
+async def async_remove_storage(hass: HomeAssistant, entry_id: str) -> None:
+    """Remove the stored snapshot and history of a logger that was deleted"""
+    await snapshot_store(hass, entry_id).async_remove()
+    path = history_path(hass, entry_id)
+    try:
+        await hass.async_add_executor_job(path.unlink)
+    except FileNotFoundError:
+        pass
+    except OSError as err:
+        _LOGGER.warning('Could not remove %s: %s', path, err)
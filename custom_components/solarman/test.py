@@ -1,4 +1,10 @@
-""" A basic client demonstrating how to use pysolarmanv5."""
+""" A basic client demonstrating how to use pysolarmanv5.
+
+Usage: python test.py [address] [serial] [port]
+e.g. `python test.py 127.0.0.1` to query a logger started with simulator.py
+"""
+import sys
+
 from pysolarmanv5.pysolarmanv5 import PySolarmanV5
 
 
@@ -9,8 +15,11 @@ def main():
     mb_slave_id, and verbose are omitted, they will default to 8899, 1 and 0
     respectively.
     """
+    address = sys.argv[1] if len(sys.argv) > 1 else "192.168.2.51"
+    serial = int(sys.argv[2]) if len(sys.argv) > 2 else 1773158214
+    port = int(sys.argv[3]) if len(sys.argv) > 3 else 8899
     modbus = PySolarmanV5(
-        "192.168.2.51", 1773158214, port=8899, mb_slave_id=1, verbose=1
+        address, serial, port=port, mb_slave_id=1, verbose=1
     )
 
     print(modbus.read_holding_registers(register_addr=0, quantity=40))
@@ -0,0 +1,114 @@
+"""Queue, batch and verify register writes to a data logger."""
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections.abc import Awaitable, Callable
+
+from .const import MODBUS_MAX_WRITE_REGISTERS
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class WriteVerificationError(Exception):
+    """A register read back after a write does not hold the value written"""
+
+
+def coalesce_writes(registers: dict[int, int], max_count: int) -> list[tuple[int, list[int]]]:
+    """Group register values into runs of adjacent registers
+
+    Returns (first register, values) pairs, each of which can be written with
+    a single 'write multiple registers' request of at most ``max_count``
+    registers. Gaps are never filled in, since that would overwrite registers
+    that were not asked to be written.
+    """
+    runs: list[tuple[int, list[int]]] = []
+    for register in sorted(registers):
+        if runs and register == runs[-1][0] + len(runs[-1][1]) and len(runs[-1][1]) < max_count:
+            runs[-1][1].append(registers[register])
+        else:
+            runs.append((register, [registers[register]]))
+    return runs
+
+
+class RegisterWriter:
+    """Applies the register writes to a logger in batches
+
+    Writes requested while a batch is being applied are queued and merged
+    into the next batch: the latest value for a register wins, and adjacent
+    registers are coalesced into a single function 16 request. A batch that
+    fails fails every write in it.
+
+    Each batch holds ``lock``, which polls hold as well, so that writes never
+    interleave with the reads of a poll on the connection.
+    """
+
+    def __init__(
+        self,
+        execute: Callable[[Callable], Awaitable],
+        lock: asyncio.Lock,
+        max_count: int = MODBUS_MAX_WRITE_REGISTERS,
+    ) -> None:
+        self._execute = execute
+        self._lock = lock
+        self._max_count = max_count
+        self._pending: dict[int, int] = {}
+        self._verify: set[int] = set()
+        self._waiters: list[asyncio.Future] = []
+        self._task: asyncio.Task | None = None
+        self.requests = 0
+
+    async def async_write(self, registers: dict[int, int], verify: bool = False) -> None:
+        """Write register values, returning once they are written (and verified)
+
+        Raises whatever the connection raised, or WriteVerificationError.
+        """
+        self._pending.update(registers)
+        if verify:
+            self._verify.update(registers)
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        if self._task is None:
+            self._task = asyncio.create_task(self._async_flush())
+        # Once queued the write goes ahead even if the caller gives up waiting
+        await asyncio.shield(future)
+
+    async def _async_flush(self) -> None:
+        try:
+            while self._pending:
+                pending, verify, waiters = self._pending, self._verify, self._waiters
+                self._pending, self._verify, self._waiters = {}, set(), []
+                try:
+                    async with self._lock:
+                        await self._async_apply(pending, verify)
+                except Exception as err:  # pylint: disable=broad-except
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(err)
+                else:
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_result(None)
+        finally:
+            self._task = None
+
+    async def _async_apply(self, registers: dict[int, int], verify: set[int]) -> None:
+        for start, values in coalesce_writes(registers, self._max_count):
+            _LOGGER.debug('writer.py:RegisterWriter: writing %s registers at 0x%04X', len(values), start)
+            self.requests += 1
+            await self._execute(
+                lambda client, start=start, values=values: client.write_multiple_holding_registers(start, values)
+            )
+            if verify.isdisjoint(range(start, start + len(values))):
+                continue
+            self.requests += 1
+            read = await self._execute(
+                lambda client, start=start, count=len(values): client.read_holding_registers(start, count)
+            )
+            mismatched = [
+                f"0x{start + i:04X}: wrote {value}, read {read[i]}"
+                for i, value in enumerate(values)
+                if start + i in verify and read[i] != value
+            ]
+            if mismatched:
+                raise WriteVerificationError(f"Registers do not hold the values written ({', '.join(mismatched)})")